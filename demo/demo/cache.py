@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+class CountingCache(BaseCache):
+    """
+    Cache backend that passes every call on to the cache alias in ``target`` and counts the calls of each thread.
+    LOCATION is the initial target, the load test switches the target between runs.
+    """
+    target = None
+    _local = threading.local()
+
+    def __init__(self, location, params):
+        super(CountingCache, self).__init__(params)
+        if CountingCache.target is None:
+            CountingCache.target = location
+
+    @classmethod
+    def get_calls(cls):
+        """
+        Number of calls (round trips) made by this thread since the last reset_calls()
+        """
+        return getattr(cls._local, 'calls', 0)
+
+    @classmethod
+    def reset_calls(cls):
+        cls._local.calls = 0
+
+    def _get_target(self):
+        self._local.calls = self.get_calls() + 1
+        return caches[self.target]
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._get_target().add(key, value, timeout, version)
+
+    def get(self, key, default=None, version=None):
+        return self._get_target().get(key, default, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._get_target().set(key, value, timeout, version)
+
+    def delete(self, key, version=None):
+        return self._get_target().delete(key, version)
+
+    def get_many(self, keys, version=None):
+        return self._get_target().get_many(keys, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._get_target().set_many(data, timeout, version)
+
+    def delete_many(self, keys, version=None):
+        return self._get_target().delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self._get_target().has_key(key, version)
+
+    def clear(self):
+        return caches[self.target].clear()
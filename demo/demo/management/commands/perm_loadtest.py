@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+
+from demo.cache import CountingCache
+from demo.models import Document
+
+USERNAME_PREFIX = 'loadtest-'
+VIEWS = ('list', 'detail', 'update')
+RESULT_HEADER = ('objects', 'cache', 'view', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+                 'queries', 'cache calls')
+
+
+def percentile(values, percent):
+    """
+    Return the ``percent`` percentile of sorted ``values`` (nearest rank)
+    """
+    if not values:
+        return 0
+    rank = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def create_dataset(objects, users, seed):
+    """
+    Replace the documents and users of the load test with ``objects`` documents owned by ``users`` users
+    """
+    user_model = get_user_model()
+    user_model.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+    user_model.objects.bulk_create([
+        user_model(username='{prefix}{index}'.format(prefix=USERNAME_PREFIX, index=index)) for index in range(users)
+    ])
+    user_pks = list(user_model.objects.filter(username__startswith=USERNAME_PREFIX).values_list('pk', flat=True))
+    rng = random.Random(seed)
+    Document.objects.bulk_create([
+        Document(
+            title='Document {index}'.format(index=index),
+            owner_id=rng.choice(user_pks),
+            # About a quarter of the documents can be seen by everybody
+            is_public=rng.random() < 0.25,
+        )
+        for index in range(objects)
+    ], batch_size=500)
+    return user_pks, list(Document.objects.values_list('pk', flat=True))
+
+
+class Worker(threading.Thread):
+    """
+    Thread that logs in as one user and requests ``count`` pages of a view
+    """
+
+    def __init__(self, view, user_pk, document_pks, count, seed, start_event):
+        super(Worker, self).__init__()
+        self.view = view
+        self.user_pk = user_pk
+        self.document_pks = document_pks
+        self.count = count
+        self.rng = random.Random(seed)
+        self.start_event = start_event
+        self.latencies = []
+        self.queries = 0
+        self.cache_calls = 0
+        self.errors = 0
+
+    def get_path(self):
+        if self.view == 'list':
+            pages = max(len(self.document_pks) // 20, 1)
+            return '/documents/?page={page}'.format(page=self.rng.randint(1, min(pages, 5)))
+        pk = self.rng.choice(self.document_pks)
+        if self.view == 'detail':
+            return '/documents/{pk}/'.format(pk=pk)
+        return '/documents/{pk}/change/'.format(pk=pk)
+
+    def run(self):
+        try:
+            client = Client()
+            client.force_login(get_user_model().objects.get(pk=self.user_pk))
+            paths = [self.get_path() for index in range(self.count)]
+            self.start_event.wait()
+            for path in paths:
+                CountingCache.reset_calls()
+                with CaptureQueriesContext(connection) as context:
+                    start = time.time()
+                    response = client.get(path)
+                    self.latencies.append(time.time() - start)
+                self.queries += len(context.captured_queries)
+                self.cache_calls += CountingCache.get_calls()
+                # Denied is a valid answer, anything else is an error
+                if response.status_code not in (200, 403, 404):
+                    self.errors += 1
+        finally:
+            connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Drive the Perm* views of the demo from many threads and report throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, nargs='+', default=[100, 1000],
+                            help='Dataset sizes (number of documents) to test')
+        parser.add_argument('--users', type=int, default=20, help='Number of users that own the documents')
+        parser.add_argument('--cache', nargs='+', default=['locmem', 'dummy'],
+                            help='Cache aliases to use for permissions')
+        parser.add_argument('--view', nargs='+', choices=VIEWS, default=list(VIEWS), help='Views to request')
+        parser.add_argument('--threads', type=int, default=8, help='Number of concurrent clients')
+        parser.add_argument('--requests', type=int, default=50, help='Number of requests per thread')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the dataset and the requests')
+
+    def handle(self, *args, **options):
+        for alias in options['cache']:
+            if alias not in settings.CACHES or alias == 'perm':
+                raise CommandError('Unknown cache alias {alias}.'.format(alias=alias))
+        if settings.DATABASES['default']['NAME'] == ':memory:':
+            raise CommandError('The load test needs a database file, threads do not share an in memory database.')
+
+        self.stdout.write('\t'.join(RESULT_HEADER))
+        for objects in options['objects']:
+            user_pks, document_pks = create_dataset(objects, options['users'], options['seed'])
+            for alias in options['cache']:
+                for view in options['view']:
+                    row = self.run_test(view, alias, user_pks, document_pks, options)
+                    self.stdout.write('\t'.join([str(objects), alias, view] + row))
+
+    def run_test(self, view, alias, user_pks, document_pks, options):
+        """
+        Start all threads at the same time, with an empty cache, and return the formatted results
+        """
+        CountingCache.target = alias
+        CountingCache(alias, {}).clear()
+        start_event = threading.Event()
+        workers = [
+            Worker(view, user_pks[index % len(user_pks)], document_pks, options['requests'],
+                   options['seed'] + index, start_event)
+            for index in range(options['threads'])
+        ]
+        for worker in workers:
+            worker.start()
+        start = time.time()
+        start_event.set()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+
+        latencies = sorted(latency for worker in workers for latency in worker.latencies)
+        count = len(latencies)
+        queries = sum(worker.queries for worker in workers)
+        cache_calls = sum(worker.cache_calls for worker in workers)
+        return [
+            str(count),
+            str(sum(worker.errors for worker in workers)),
+            '{0:.1f}'.format(count / elapsed if elapsed else 0),
+            '{0:.1f}'.format(percentile(latencies, 50) * 1000),
+            '{0:.1f}'.format(percentile(latencies, 95) * 1000),
+            '{0:.1f}'.format(percentile(latencies, 99) * 1000),
+            '{0:.1f}'.format(queries / float(count) if count else 0),
+            '{0:.1f}'.format(cache_calls / float(count) if count else 0),
+        ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+
+from perm.decorators import permissions_for
+from perm.permissions import ModelPermissions
+from perm.rules import FieldIs, FieldIsUser
+
+
+@python_2_unicode_compatible
+class Document(models.Model):
+    title = models.CharField(max_length=100)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='documents')
+    is_public = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.title
+
+
+@permissions_for(Document)
+class DocumentPermissions(ModelPermissions):
+    rules = {
+        'list': FieldIs('is_public') | FieldIsUser('owner'),
+        'view': FieldIs('is_public') | FieldIsUser('owner'),
+        'change': FieldIsUser('owner'),
+    }
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.conf.urls import patterns, url
+from django.conf.urls import url
 
-from .views import HomeView, ServerErrorView, ObjectDoesNotExistView, PermissionDeniedView
+from .views import (
+    HomeView, ServerErrorView, ObjectDoesNotExistView, PermissionDeniedView, DocumentListView, DocumentDetailView,
+    DocumentUpdateView,
+)
 
 # Uncomment the next two lines to enable the admin:
 # from django.contrib import admin
@@ -21,9 +24,12 @@ from .views import HomeView, ServerErrorView, ObjectDoesNotExistView, Permission
 #     # url(r'^admin/', include(admin.site.urls)),
 # )
 
-urlpatterns = patterns('',
+urlpatterns = [
     url(r'^$', HomeView.as_view(), name='home'),
     url(r'^permission_denied$', PermissionDeniedView.as_view(), name='permission_denied'),
     url(r'^object_does_not_exist$', ObjectDoesNotExistView.as_view(), name='object_does_not_exist'),
     url(r'^server_error$', ServerErrorView.as_view(), name='server_error'),
-)
+    url(r'^documents/$', DocumentListView.as_view(), name='document_list'),
+    url(r'^documents/(?P<pk>\d+)/$', DocumentDetailView.as_view(), name='document_detail'),
+    url(r'^documents/(?P<pk>\d+)/change/$', DocumentUpdateView.as_view(), name='document_update'),
+]
@@ -5,6 +5,10 @@ from django.http import Http404
 
 from django.views.generic.base import TemplateView
 
+from perm.views import PermListView, PermDetailView, PermUpdateView
+
+from .models import Document
+
 
 class HomeView(TemplateView):
     template_name = 'demo/home.html'
@@ -35,3 +39,18 @@ class ServerErrorView(ExceptionView):
         context['fail'] = None + True + 'fail' + {}
         return context
 
+
+class DocumentListView(PermListView):
+    model = Document
+    ordering = ('pk', )
+    paginate_by = 20
+    prefetch_perms = ('change', )
+
+
+class DocumentDetailView(PermDetailView):
+    model = Document
+
+
+class DocumentUpdateView(PermUpdateView):
+    model = Document
+    fields = ('title', 'is_public')
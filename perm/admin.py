@@ -1,2 +1,119 @@
-# If there is ever any integration with django.contrib.admin, then this is important:
-# https://code.djangoproject.com/wiki/RowLevelPermissions
\ No newline at end of file
+from __future__ import unicode_literals
+
+from .bulk import bulk_has_perm
+from .exceptions import PermAppException
+from .permissions import permissions_manager
+from .shortcuts import get_perm_queryset
+
+
+# Integration with django.contrib.admin, see https://code.djangoproject.com/wiki/RowLevelPermissions
+# The Django model permissions give access to the admin pages for a model, the ModelPermissions registered
+# for the model decide which rows can be seen, changed and deleted.
+
+
+class PermChangeListMixin(object):
+    """
+    Let the model admin compute the permissions for all rows on the page once the rows are known
+    """
+
+    def get_results(self, request):
+        super(PermChangeListMixin, self).get_results(request)
+        # Evaluating the page caches its rows, the template and formsets do not query them again
+        self.model_admin.precompute_row_perms(request, list(self.result_list))
+
+
+class PermModelAdminMixin(object):
+    """
+    ModelAdmin mixin that filters the changelist through the queryset for ``perm_queryset``
+    and checks ``perm_view``, ``perm_change`` and ``perm_delete`` on objects through the registered
+    ModelPermissions. Set any of these to None to keep the default behaviour of ModelAdmin.
+    """
+    perm_queryset = 'view'
+    perm_view = 'view'
+    perm_change = 'change'
+    perm_delete = 'delete'
+
+    def _is_superuser(self, request):
+        user = request.user
+        return user.is_active and user.is_superuser
+
+    def get_queryset(self, request):
+        """
+        Only show the objects in the permission queryset, none if the model has no queryset for ``perm_queryset``
+        """
+        qs = super(PermModelAdminMixin, self).get_queryset(request)
+        if not self.perm_queryset or self._is_superuser(request):
+            return qs
+        try:
+            perm_qs = get_perm_queryset(self.model, request.user, self.perm_queryset)
+        except PermAppException:
+            # Not registered, or only a has_perm_PERM method: a changelist without rows, not a server error
+            return qs.none()
+        # The permission queryset becomes a subquery on the same database
+        return qs.filter(pk__in=perm_qs.using(qs.db))
+
+    def get_changelist(self, request, **kwargs):
+        changelist_class = super(PermModelAdminMixin, self).get_changelist(request, **kwargs)
+        return type(str('Perm{name}'.format(name=changelist_class.__name__)),
+                    (PermChangeListMixin, changelist_class), {})
+
+    def get_row_perms(self, request):
+        """
+        Get the permissions computed by precompute_row_perms() for this request, keyed by (perm, pk)
+        """
+        try:
+            row_perms = request._perm_admin_rows
+        except AttributeError:
+            row_perms = request._perm_admin_rows = {}
+        return row_perms.setdefault(self.model, {})
+
+    def precompute_row_perms(self, request, objects):
+        """
+        Check the object permissions of the admin for all ``objects`` at once
+        """
+        if not objects or self._is_superuser(request):
+            return
+        if not permissions_manager.get_permissions_class(self.model):
+            return
+        row_perms = self.get_row_perms(request)
+        perms = [perm for perm in (self.perm_view, self.perm_change, self.perm_delete) if perm]
+        for perm in sorted(set(perms)):
+            results = bulk_has_perm(request.user, perm, objects)
+            for obj, result in zip(objects, results):
+                row_perms[(perm, obj.pk)] = result
+
+    def has_row_perm(self, request, perm, obj):
+        """
+        Test ``perm`` on ``obj``, using the result of precompute_row_perms() if there is one
+        """
+        row_perms = self.get_row_perms(request)
+        try:
+            return row_perms[(perm, obj.pk)]
+        except KeyError:
+            return request.user.has_perm(perm, obj)
+
+    def _has_permission(self, request, obj, perm, default):
+        if not perm:
+            return default(request, obj)
+        if obj is None:
+            # Access to the admin pages for the model
+            return default(request, obj) or request.user.has_perm(perm, self.model)
+        return self.has_row_perm(request, perm, obj)
+
+    def has_view_permission(self, request, obj=None):
+        """
+        Used by Django versions with view permissions in the admin
+        """
+        default = getattr(super(PermModelAdminMixin, self), 'has_view_permission', None)
+        if default is None:
+            # Older Django versions show everything to users that can change
+            default = super(PermModelAdminMixin, self).has_change_permission
+        return self._has_permission(request, obj, self.perm_view, default)
+
+    def has_change_permission(self, request, obj=None):
+        default = super(PermModelAdminMixin, self).has_change_permission
+        return self._has_permission(request, obj, self.perm_change, default)
+
+    def has_delete_permission(self, request, obj=None):
+        default = super(PermModelAdminMixin, self).has_delete_permission
+        return self._has_permission(request, obj, self.perm_delete, default)
@@ -0,0 +1,156 @@
+from __future__ import unicode_literals
+
+import gzip
+import io
+import multiprocessing
+
+import django
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db import connections
+
+from .exceptions import PermQuerySetNotFound
+from .permissions import permissions_manager
+from .utils import get_model_for_perm, get_model_label, iter_chunks_by_pk
+
+AUDIT_HEADER = '# perm audit 1'
+
+
+def audit_unit(unit):
+    """
+    Compute the permission matrix for one unit of work: a tuple (model label, perm, user pks, chunk size).
+    Return a list of tuples (model label, perm, user pk, sorted pks of allowed objects).
+    Permissions are evaluated without the cache, in the same order as ModelPermissions._has_perm().
+    """
+    model_label, perm, user_pks, chunk_size = unit
+    model = get_model_for_perm(model_label, raise_exception=True)
+    permissions_class = permissions_manager.get_permissions_class(model)
+    users = list(get_user_model()._default_manager.filter(pk__in=user_pks).order_by('pk'))
+    allowed = dict((user.pk, []) for user in users)
+
+    if hasattr(permissions_class, 'has_perm_%s' % perm):
+        # Methods have to look at every object
+        objects = permissions_class.prepare_queryset(model._default_manager.all(), perm)
+        for chunk in iter_chunks_by_pk(objects, chunk_size):
+            for obj in chunk:
+                for user in users:
+                    if permissions_class(model, user, perm, obj)._has_perm():
+                        allowed[user.pk].append(obj.pk)
+    else:
+        # Rules and querysets take one query per user
+        for user in users:
+            permissions = permissions_class(model, user, perm)
+            if not permissions._check_user():
+                continue
+            try:
+                queryset = permissions.get_queryset()
+            except PermQuerySetNotFound:
+                continue
+            allowed[user.pk] = list(queryset.values_list('pk', flat=True).distinct())
+
+    return [(model_label, perm, user.pk, sorted(allowed[user.pk])) for user in users]
+
+
+def _init_worker():
+    # Workers started with spawn need to set up Django, forked workers already have
+    if not apps.ready:
+        django.setup()
+
+
+def get_audit_units(models, perms=None, user_pks=None, chunk_size=100):
+    """
+    Split the permission matrix for ``models`` into units of work of at most ``chunk_size`` users
+    """
+    if user_pks is None:
+        user_pks = list(get_user_model()._default_manager.order_by('pk').values_list('pk', flat=True))
+    units = []
+    for model in models:
+        model = get_model_for_perm(model, raise_exception=True)
+        permissions_class = permissions_manager.get_permissions_class(model)
+        if not permissions_class:
+            continue
+        model_perms = perms if perms else permissions_class.get_perm_names()
+        for perm in model_perms:
+            for start in range(0, len(user_pks), chunk_size):
+                units.append((get_model_label(model), perm, tuple(user_pks[start:start + chunk_size]), chunk_size))
+    return units
+
+
+def compute_audit(units, processes=None):
+    """
+    Compute all ``units`` on a pool of ``processes`` workers (default one per CPU), in order.
+    Yields the result of audit_unit() for each unit.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1:
+        for unit in units:
+            yield audit_unit(unit)
+        return
+    # Workers must not share the connections of this process, each opens its own
+    connections.close_all()
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        for result in pool.imap(audit_unit, units):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_audit(units, path, processes=None):
+    """
+    Compute all ``units`` on a pool of ``processes`` workers and write the results to gzipped file ``path``.
+    Return the number of lines written.
+    """
+    # gzip.open() has no text mode in Python 2
+    with io.TextIOWrapper(gzip.open(path, 'wb'), encoding='utf-8') as output:
+        output.write(AUDIT_HEADER + '\n')
+        return _write_results(output, compute_audit(units, processes))
+
+
+def _write_results(output, results):
+    count = 0
+    for lines in results:
+        for model_label, perm, user_pk, object_pks in lines:
+            output.write('{model}\t{perm}\t{user}\t{objects}\n'.format(
+                model=model_label,
+                perm=perm,
+                user=user_pk,
+                objects=','.join('{pk}'.format(pk=pk) for pk in object_pks),
+            ))
+            count += 1
+    return count
+
+
+def read_audit(path):
+    """
+    Read an audit file, return a dict {(model label, perm, user pk): set of allowed object pks as strings}
+    """
+    matrix = {}
+    with io.TextIOWrapper(io.BufferedReader(gzip.open(path, 'rb')), encoding='utf-8') as audit:
+        for line in audit:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            model_label, perm, user_pk, object_pks = line.split('\t')
+            matrix[(model_label, perm, user_pk)] = set(object_pks.split(',')) if object_pks else set()
+    return matrix
+
+
+def diff_audits(old_path, new_path):
+    """
+    Compare two audit files, return a sorted list of tuples (sign, model label, perm, user pk, object pk).
+    Sign is '+' for a permission that was granted in the new audit only, '-' for one that was revoked.
+    """
+    old = read_audit(old_path)
+    new = read_audit(new_path)
+    changes = []
+    for key in set(old) | set(new):
+        old_pks = old.get(key, set())
+        new_pks = new.get(key, set())
+        for object_pk in new_pks - old_pks:
+            changes.append(('+',) + key + (object_pk,))
+        for object_pk in old_pks - new_pks:
+            changes.append(('-',) + key + (object_pk,))
+    return sorted(changes, key=lambda change: change[1:] + (change[0],))
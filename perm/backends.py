@@ -3,9 +3,11 @@ from __future__ import unicode_literals
 from django.db.models import Model
 from django.utils.translation import ugettext_lazy as _
 
+from .debug import tracing, trace_check, trace_record
 from .exceptions import PermAppException
+from .expressions import PermExpression
 from .permissions import permissions_manager
-from .utils import get_model_for_perm
+from .utils import get_model_for_perm, get_model_label, parse_perm
 
 
 class ModelPermissionBackend(object):
@@ -20,51 +22,58 @@ class ModelPermissionBackend(object):
         return None
 
     def has_perm(self, user_obj, perm, obj=None):
+        if tracing():
+            with trace_check(user_obj, perm, obj) as trace:
+                trace['result'] = self._has_perm(user_obj, perm, obj)
+                return trace['result']
+        return self._has_perm(user_obj, perm, obj)
+
+    def _has_perm(self, user_obj, perm, obj=None):
 
         # If obj is a Model instance, get the model class
         if not obj:
-            obj = None
-            model = None
+            return False
         elif isinstance(obj, Model):
             model = obj.__class__
+            trace_record(model_resolved_from='instance')
+        elif isinstance(obj, type) and issubclass(obj, Model):
+            model = obj
+            obj = None
+            trace_record(model_resolved_from='class')
         else:
-            model = None
-            try:
-                if issubclass(obj, Model):
-                    model = obj
-                    obj = None
-            except TypeError:
-                # TypeError is raised if obj is not a class
-                pass
-            if not model:
-                model = get_model_for_perm(obj, raise_exception=False)
+            # Strings are resolved once and then remembered
+            model = get_model_for_perm(obj, raise_exception=False)
+            obj = None
+            trace_record(model_resolved_from='string')
 
         # Without a model, this backend can only return False
         if not model:
+            trace_record(path='no model')
             return False
 
-        # If permission is in dot notation,
-        perm_parts = perm.split('.')
-        if len(perm_parts) > 1:
-            # Keep only the last part of the permission (without application name)
-            perm_app, perm = perm_parts
-            # Make sure permission and object application are the same
-            if model:
-                model_app = model._meta.app_label
-                if perm_app != model_app:
-                    raise PermAppException(
-                        _("App mismatch, perm has '%(perm_app)s' and model has '%(model_app)s'" % {
-                            'perm_app': perm_app,
-                            'model_app': model_app,
-                        })
-                    )
+        # No ModelPermissions means no permission, no need to look at the permission itself
+        permissions_class = permissions_manager.get_permissions_class(model)
+        if not permissions_class:
+            trace_record(path='not registered')
+            return False
+        trace_record(model=get_model_label(model))
 
-        # Get the ModelPermissions object
-        object_permissions = permissions_manager.get_permissions(model, user_obj, perm, obj)
+        # Expressions combine permissions of the class, and choose the order of evaluation themselves
+        if isinstance(perm, PermExpression):
+            return perm.evaluate(permissions_class, model, user_obj, obj)
 
-        # No ModelPermissions means no permission
-        if not object_permissions:
-            return False
+        # If permission is in dot notation, keep only the last part (without application name)
+        perm_app, perm = parse_perm(perm)
+        # Make sure permission and object application are the same
+        if perm_app is not None:
+            model_app = model._meta.app_label
+            if perm_app != model_app:
+                raise PermAppException(
+                    _("App mismatch, perm has '%(perm_app)s' and model has '%(model_app)s'" % {
+                        'perm_app': perm_app,
+                        'model_app': model_app,
+                    })
+                )
 
         # Check the permissions
-        return object_permissions.has_perm()
+        return permissions_class(model, user_obj, perm, obj).has_perm()
@@ -0,0 +1,190 @@
+from __future__ import unicode_literals
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from django.db.models.query import QuerySet
+
+from .cache import cache_get_many, cache_set_many
+from .conf import perm_settings
+from .exceptions import PermRuleNotFound
+from .permissions import permissions_manager
+from .refresh import refresh_ahead
+from .routing import using_primary
+from .utils import call_in_worker
+
+
+class _Check(object):
+    """
+    Callable that evaluates one ModelPermissions object in a worker thread
+    """
+    started = None
+
+    def __init__(self, permissions):
+        self.permissions = permissions
+
+    def __call__(self):
+        self.started = time.time()
+        return call_in_worker(self.permissions.has_perm)
+
+
+def _wait_for_check(future, check, timeout):
+    """
+    Wait for a check, allowing it ``timeout`` seconds once it has started running
+    """
+    if timeout is None:
+        return future.result()
+    while True:
+        started = check.started
+        if started is None:
+            wait = timeout
+        else:
+            wait = max(started + timeout - time.time(), 0)
+        try:
+            return future.result(timeout=wait)
+        except FuturesTimeoutError:
+            if started is not None:
+                raise
+
+
+def _is_method_based(permissions):
+    return permissions is not None and hasattr(permissions, 'has_perm_%s' % permissions.perm)
+
+
+def _has_perm_in_order(checks, indexes, results):
+    """
+    Fill ``results`` at ``indexes`` with the results of ``checks`` there, using has_perm_many()
+    """
+    indexes = [index for index in indexes if checks[index]]
+    for index, result in zip(indexes, has_perm_many([checks[index] for index in indexes])):
+        results[index] = result
+    return results
+
+
+def bulk_has_perm(user, perm, objects, workers=None, timeout=None, timeout_result=False):
+    """
+    Return a list with the result of permission ``perm`` for ``user`` on each of ``objects``, in order.
+    If ``workers`` > 1, method based checks (has_perm_PERM) are run on a pool of that many threads,
+    and a threaded check that runs longer than ``timeout`` seconds counts as ``timeout_result``.
+    """
+    bulk_settings = perm_settings['bulk']
+    if workers is None:
+        workers = bulk_settings['workers']
+    if timeout is None:
+        timeout = bulk_settings['timeout']
+
+    if isinstance(objects, QuerySet):
+        # Rules can check all objects in the same query that loads them
+        permissions_class = permissions_manager.get_permissions_class(objects.model)
+        if permissions_class:
+            try:
+                return permissions_class(objects.model, user, perm)._bulk_has_perm_using_rule(objects)
+            except PermRuleNotFound:
+                pass
+
+    # Load what the checks need before any object is evaluated
+    if isinstance(objects, QuerySet):
+        objects = permissions_manager.prepare_queryset(objects, perm)
+    else:
+        objects = permissions_manager.prepare_objects(objects, perm)
+
+    checks = [permissions_manager.get_permissions(obj.__class__, user, perm, obj) for obj in objects]
+    results = [False] * len(checks)
+
+    # Only independent method based checks go to the thread pool
+    parallel = []
+    if workers > 1:
+        parallel = [index for index, permissions in enumerate(checks) if _is_method_based(permissions)]
+    if not parallel:
+        return _has_perm_in_order(checks, range(len(checks)), results)
+
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(parallel)))
+    try:
+        pending = []
+        for index in parallel:
+            check = _Check(checks[index])
+            pending.append((index, check, executor.submit(check)))
+
+        # Run the other checks in this thread while the pool is working
+        in_pool = set(parallel)
+        _has_perm_in_order(checks, [index for index in range(len(checks)) if index not in in_pool], results)
+
+        for index, check, future in pending:
+            try:
+                results[index] = _wait_for_check(future, check, timeout)
+            except FuturesTimeoutError:
+                results[index] = timeout_result
+    finally:
+        # Do not wait for checks that have timed out
+        executor.shutdown(wait=False)
+
+    return results
+
+
+def _has_perm_using_queryset_many(checks):
+    """
+    Return a list with the result of each ModelPermissions object in ``checks``, which must all be for the
+    same class, user and permission, using one ``pk__in`` query on the permission queryset
+    """
+    pks = [permissions.obj.pk for permissions in checks]
+    allowed = set(checks[0].get_queryset().filter(pk__in=pks).values_list('pk', flat=True))
+    return [pk in allowed for pk in pks]
+
+
+def has_perm_many(checks):
+    """
+    Return a list with the result of each ModelPermissions object in ``checks``, in order.
+    The cache is read with one lookup and written with one update. Checks that would each run a query on
+    the same permission queryset are done together, in one query.
+    """
+    # Within use_primary() the snapshot and the cache may be behind, see perm.routing
+    primary = using_primary()
+    results = [None if primary else permissions._lookup_snapshot() for permissions in checks]
+    pending = [index for index, result in enumerate(results) if result is None]
+    cache_keys = dict((index, checks[index].get_cache_key()) for index in pending)
+    cached = {} if primary else cache_get_many(list(cache_keys.values()))
+
+    uncached = {}
+    batches = {}
+    for index in pending:
+        permissions = checks[index]
+        result = cached.get(cache_keys[index])
+        if result is not None:
+            refresh_ahead.record_hit(cache_keys[index], permissions)
+        else:
+            if permissions._can_batch_queryset():
+                user_pk = getattr(permissions.user, 'pk', None)
+                key = (permissions.__class__, permissions.model, user_pk, permissions.perm)
+                batches.setdefault(key, []).append(index)
+                continue
+            result, cacheable = permissions._evaluate(cache_keys[index])
+            if cacheable:
+                uncached[cache_keys[index]] = result
+        results[index] = result
+
+    for indexes in batches.values():
+        batch_results = _has_perm_using_queryset_many([checks[index] for index in indexes])
+        for index, result in zip(indexes, batch_results):
+            results[index] = result
+            uncached[cache_keys[index]] = result
+
+    if uncached:
+        cache_set_many(uncached)
+        for key in uncached:
+            refresh_ahead.record_set(key)
+    return results
+
+
+def get_perms_for_object(user, obj, perms=None):
+    """
+    Return a dict with the result of each of ``perms`` for ``user`` on ``obj``, using one cache lookup.
+    If ``perms`` is None, all permissions of the registered ModelPermissions class are checked.
+    """
+    permissions_class = permissions_manager.get_permissions_class(obj.__class__)
+    if not permissions_class:
+        return {}
+    if perms is None:
+        perms = permissions_class.get_perm_names()
+    perms = list(perms)
+    checks = [permissions_class(obj.__class__, user, perm, obj) for perm in perms]
+    return dict(zip(perms, has_perm_many(checks)))
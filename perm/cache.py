@@ -1,8 +1,10 @@
 from __future__ import unicode_literals
 
 import hashlib
+import time
 
 from .conf import perm_settings
+from .utils import get_model_label
 
 from django.core.cache import caches
 
@@ -19,11 +21,30 @@ def cache_get(key, default=None):
     return _cache.get(key, default)
 
 
-def cache_set(key, value):
+_default = object()
+
+
+def cache_set(key, value, expires=_default):
+    """
+    Set a value in the cache, for ``expires`` seconds (None means forever)
+    """
+    if expires is _default:
+        expires = _cache_expires
+    return _cache.set(key, value, expires)
+
+
+def cache_get_many(keys):
+    """
+    Get a dict with the values that are available in the cache for ``keys``
+    """
+    return _cache.get_many(keys)
+
+
+def cache_set_many(data):
     """
-    Set a value in the cache
+    Set all key/value pairs in dict ``data`` in the cache
     """
-    return _cache.set(key, value, _cache_expires)
+    return _cache.set_many(data, _cache_expires)
 
 
 def cache_key(**kwargs):
@@ -37,3 +58,31 @@ def cache_key(**kwargs):
     hash_string = hash_object.hexdigest()
     # Prepend PERM for clarity
     return 'PERM-{hash_string}'.format(hash_string=hash_string)
+
+
+def _get_generation_key(model):
+    return 'PERM-GEN-{label}'.format(label=get_model_label(model))
+
+
+def get_generation(model):
+    """
+    Get the generation of ``model``, it changes whenever its objects are written
+    """
+    key = _get_generation_key(model)
+    generation = _cache.get(key)
+    if generation is None:
+        # A new generation never repeats an old one, even if the cache lost the key
+        _cache.add(key, int(time.time() * 1000), None)
+        generation = _cache.get(key, 0)
+    return generation
+
+
+def bump_generation(model):
+    """
+    Start a new generation of ``model``, cached values that include the generation are no longer used
+    """
+    key = _get_generation_key(model)
+    try:
+        _cache.incr(key)
+    except ValueError:
+        _cache.set(key, int(time.time() * 1000), None)
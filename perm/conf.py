@@ -3,11 +3,73 @@ from __future__ import unicode_literals
 from django.conf import settings as django_settings
 
 PERM_DEFAULT_SETTINGS = {
+    # Database alias for permission queries (e.g. a read replica), None means the default routing
+    'database': None,
     'cache': {
         'name': 'default',
         'expires': 60,
-    }
+    },
+    'bulk': {
+        'workers': 1,
+        'timeout': None,
+    },
+    'timeouts': {
+        # Default time budget in seconds for every check, None means no limit
+        'budget': None,
+        # What to do when a check exceeds its budget: 'deny', 'cached' (last known value) or 'raise'
+        'fallback': 'deny',
+        # Number of threads that run time bounded checks
+        'workers': 10,
+        # Skip a permission for ``cooldown`` seconds after ``threshold`` consecutive slow checks
+        'threshold': 3,
+        'cooldown': 30,
+        # With the 'cached' fallback, keep the last known value this many times as long as the regular cache entry
+        'last_known_factor': 10,
+    },
+    'snapshot': {
+        # Path of a snapshot made with the perm_snapshot command, None means no snapshot
+        'path': None,
+        # Ignore a snapshot that is older than this many seconds
+        'max_age': 3600,
+        # Look for a new snapshot file at most every this many seconds
+        'check_interval': 5,
+    },
+    'counts': {
+        # Seconds to cache the counts of PermListView pages, None means counts are not cached.
+        # When set, saving or deleting an object of a registered model invalidates the counts for its model.
+        'expires': None,
+    },
+    'refresh': {
+        # Evaluate hot cache entries again before they expire: 'thread' (on a pool of threads), 'response' (after the
+        # response has been sent) or None (off)
+        'mode': None,
+        # A cache key is hot after this many hits since it was set
+        'hits': 10,
+        # Refresh hot keys in this last fraction of their expiry time
+        'ahead': 0.2,
+        # Threads for 'thread' mode, and the most refreshes that may wait for them
+        'workers': 2,
+        'max_pending': 100,
+        # Number of cache keys to count hits for in each process
+        'max_keys': 10000,
+    },
+    'expressions': {
+        # Weight of the newest observation in the average cost and outcome of a permission (0 to 1)
+        'weight': 0.1,
+    },
 }
 
-perm_settings = PERM_DEFAULT_SETTINGS.copy()
-perm_settings.update(getattr(django_settings, 'PERM_SETTINGS', {}))
+
+def merge_settings(defaults, settings):
+    """
+    Return ``defaults`` updated with ``settings``, a section (dict) in ``settings`` only overrides the keys it has
+    """
+    merged = defaults.copy()
+    for name, value in settings.items():
+        if isinstance(value, dict) and isinstance(merged.get(name), dict):
+            value = merge_settings(merged[name], value)
+        merged[name] = value
+    return merged
+
+
+perm_settings = merge_settings(PERM_DEFAULT_SETTINGS, getattr(django_settings, 'PERM_SETTINGS', {}))
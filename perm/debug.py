@@ -0,0 +1,136 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+
+_local = threading.local()
+
+
+def _get_stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def tracing():
+    """
+    Return True if permission checks in this thread are being traced
+    """
+    return getattr(_local, 'traces', None) is not None
+
+
+def trace_record(**kwargs):
+    """
+    Add information to the trace of the permission check that is running, if any
+    """
+    if not tracing():
+        return
+    stack = _get_stack()
+    if stack:
+        stack[-1].update(kwargs)
+
+
+class _QueryCapture(object):
+    """
+    Record the queries on a connection while a check runs, like CaptureQueriesContext without django.test
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def start(self):
+        self.force_debug_cursor = self.connection.force_debug_cursor
+        self.connection.force_debug_cursor = True
+        self.initial = len(self.connection.queries_log)
+
+    def stop(self):
+        self.connection.force_debug_cursor = self.force_debug_cursor
+        self.captured_queries = list(self.connection.queries_log)[self.initial:]
+
+
+@contextmanager
+def trace_check(user_obj, perm, obj=None):
+    """
+    Trace a single permission check, used by ModelPermissionBackend.has_perm
+    """
+    trace = {
+        'user': '{user}'.format(user=user_obj),
+        'perm': perm,
+        'obj': '{obj}'.format(obj=obj) if obj is not None else None,
+        'model': None,
+        'model_resolved_from': None,
+        'permissions_class': None,
+        'path': None,
+        'cache_key': None,
+        'cache_hit': None,
+        'queries': [],
+        'duration': None,
+        'result': None,
+    }
+    _local.traces.append(trace)
+    stack = _get_stack()
+    stack.append(trace)
+    captures = [_QueryCapture(connections[alias]) for alias in connections]
+    start = time.time()
+    for capture in captures:
+        capture.start()
+    try:
+        yield trace
+    finally:
+        for capture in captures:
+            capture.stop()
+        trace['duration'] = time.time() - start
+        for capture in captures:
+            for query in capture.captured_queries:
+                trace['queries'].append({
+                    'using': capture.connection.alias,
+                    'sql': query['sql'],
+                    'time': float(query['time']),
+                })
+        stack.pop()
+
+
+@contextmanager
+def trace_perms():
+    """
+    Trace all permission checks in this thread, yields a list that is filled with one dict per check
+    """
+    previous = getattr(_local, 'traces', None)
+    traces = []
+    _local.traces = traces
+    try:
+        yield traces
+    finally:
+        _local.traces = previous
+        if previous is not None:
+            previous.extend(traces)
+
+
+def explain_perm(user, perm, obj=None):
+    """
+    Check ``user.has_perm(perm, obj)`` and return a dict that explains how the result was reached
+    """
+    with trace_perms() as traces:
+        start = time.time()
+        result = user.has_perm(perm, obj)
+        total_duration = time.time() - start
+    if traces:
+        explanation = dict(traces[0])
+        explanation['nested'] = traces[1:]
+    else:
+        # Another backend decided, for instance because the user is an active superuser
+        explanation = {
+            'user': '{user}'.format(user=user),
+            'perm': perm,
+            'obj': '{obj}'.format(obj=obj) if obj is not None else None,
+            'nested': [],
+        }
+    explanation['backend_called'] = bool(traces)
+    explanation['result'] = result
+    explanation['total_duration'] = total_duration
+    return explanation
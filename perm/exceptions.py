@@ -26,8 +26,29 @@ class PermMethodNotFound(PermAppException):
     pass
 
 
+class PermRuleNotFound(PermAppException):
+    """
+    The rule we were looking for was not found
+    """
+    pass
+
+
 class PermPrimaryKeyNotFound(PermAppException):
     """
     The instance we are evaluating has no primary key
     """
     pass
+
+
+class PermTimeoutExceeded(PermException):
+    """
+    Evaluating a permission took longer than its time budget
+    """
+    pass
+
+
+class PermCircuitOpen(PermTimeoutExceeded):
+    """
+    A permission was not evaluated because it has been too slow too often
+    """
+    pass
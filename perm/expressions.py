@@ -0,0 +1,218 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from django.db.models import Model
+
+from .conf import perm_settings
+from .permissions import permissions_manager
+from .utils import get_model_for_perm, parse_perm
+
+# Lowest chance to decide that is used to rank a check, so checks that never decide are not ranked infinitely low
+MIN_DECISIVE_RATE = 0.01
+
+
+class PermStatsRegistry(object):
+    """
+    Singleton object to hold the observed cost and outcome of permissions and expressions,
+    for each permissions class
+    """
+    _stats = {}
+    _lock = threading.Lock()
+
+    def get_name(self, permissions_class, key):
+        return '{module}.{name}:{key}'.format(
+            module=permissions_class.__module__,
+            name=permissions_class.__name__,
+            key=key,
+        )
+
+    def record(self, permissions_class, key, cost, result):
+        """
+        Add an observation, the averages weigh recent observations more
+        """
+        name = self.get_name(permissions_class, key)
+        weight = perm_settings['expressions']['weight']
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = {'count': 1, 'cost': cost, 'true_rate': 1.0 if result else 0.0}
+            else:
+                stats['count'] += 1
+                stats['cost'] += weight * (cost - stats['cost'])
+                stats['true_rate'] += weight * ((1.0 if result else 0.0) - stats['true_rate'])
+
+    def get(self, permissions_class, key):
+        """
+        Return (cost, true_rate) for ``key``, or None if it has not been evaluated yet
+        """
+        stats = self._stats.get(self.get_name(permissions_class, key))
+        if stats is None:
+            return None
+        return stats['cost'], stats['true_rate']
+
+    def get_stats(self):
+        """
+        Return a dict with a copy of the statistics, keyed by name
+        """
+        with self._lock:
+            return dict((name, dict(stats)) for name, stats in self._stats.items())
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+# Instantiate the singleton
+perm_stats = PermStatsRegistry()
+
+
+def get_perm_stats():
+    """
+    Return the observed cost and outcome of all permissions in expressions, for monitoring
+    """
+    return perm_stats.get_stats()
+
+
+class PermExpression(object):
+    """
+    Base class for permission expressions, combine them with ``&``, ``|`` and ``~``.
+    Check an expression with ``user.has_perm(expression, obj)`` or ``expression.has_perm(user, obj)``.
+    """
+
+    def get_key(self):
+        """
+        Return a string that identifies this expression
+        """
+        raise NotImplementedError
+
+    def _evaluate(self, permissions_class, model, user_obj, obj):
+        raise NotImplementedError
+
+    def evaluate(self, permissions_class, model, user_obj, obj):
+        """
+        Evaluate for the registered ``permissions_class`` of ``model``, and record the cost and outcome
+        """
+        start = time.time()
+        result = self._evaluate(permissions_class, model, user_obj, obj)
+        perm_stats.record(permissions_class, self.get_key(), time.time() - start, result)
+        return result
+
+    def has_perm(self, user_obj, obj):
+        """
+        Test the expression for ``user_obj`` on ``obj`` (a model instance, class or string)
+        """
+        if isinstance(obj, Model):
+            model = obj.__class__
+        else:
+            model = get_model_for_perm(obj, raise_exception=False)
+            obj = None
+        permissions_class = permissions_manager.get_permissions_class(model) if model else None
+        if not permissions_class:
+            return False
+        return self.evaluate(permissions_class, model, user_obj, obj)
+
+    def __and__(self, other):
+        return AllPerms(self, other)
+
+    def __or__(self, other):
+        return AnyPerm(self, other)
+
+    def __invert__(self):
+        return NotPerm(self)
+
+    def __str__(self):
+        return self.get_key()
+
+
+def _to_expression(value):
+    if isinstance(value, PermExpression):
+        return value
+    return Perm(value)
+
+
+class Perm(PermExpression):
+    """
+    A single permission of the registered ModelPermissions class, e.g. Perm('change')
+    """
+
+    def __init__(self, perm):
+        # Like the backend, ignore the application name
+        self.perm = parse_perm(perm)[1]
+
+    def get_key(self):
+        return self.perm
+
+    def _evaluate(self, permissions_class, model, user_obj, obj):
+        return permissions_class(model, user_obj, self.perm, obj).has_perm()
+
+
+class _CompositePerm(PermExpression):
+    """
+    Evaluate the children until one returns ``decisive_result``, children that are cheap and likely to decide
+    go first
+    """
+    name = None
+    decisive_result = None
+
+    def __init__(self, *children):
+        self.children = [_to_expression(child) for child in children]
+
+    def get_key(self):
+        return '{name}({children})'.format(
+            name=self.name,
+            children=','.join(child.get_key() for child in self.children),
+        )
+
+    def get_order(self, permissions_class):
+        """
+        Return the children ordered by expected cost per decision. Children that have not been evaluated yet go
+        first, so they get measured; ties keep the order in which the children were given.
+        """
+        def get_score(child):
+            stats = perm_stats.get(permissions_class, child.get_key())
+            if stats is None:
+                return 0
+            cost, true_rate = stats
+            decisive_rate = true_rate if self.decisive_result else 1 - true_rate
+            return cost / max(decisive_rate, MIN_DECISIVE_RATE)
+
+        return sorted(self.children, key=get_score)
+
+    def _evaluate(self, permissions_class, model, user_obj, obj):
+        for child in self.get_order(permissions_class):
+            if child.evaluate(permissions_class, model, user_obj, obj) == self.decisive_result:
+                return self.decisive_result
+        return not self.decisive_result
+
+
+class AnyPerm(_CompositePerm):
+    """
+    At least one of the permissions applies, same as ``Perm('a') | Perm('b')``
+    """
+    name = 'any'
+    decisive_result = True
+
+
+class AllPerms(_CompositePerm):
+    """
+    All permissions apply, same as ``Perm('a') & Perm('b')``
+    """
+    name = 'all'
+    decisive_result = False
+
+
+class NotPerm(PermExpression):
+    """
+    The permission does not apply, same as ``~Perm('a')``
+    """
+
+    def __init__(self, child):
+        self.child = _to_expression(child)
+
+    def get_key(self):
+        return 'not({child})'.format(child=self.child.get_key())
+
+    def _evaluate(self, permissions_class, model, user_obj, obj):
+        return not self.child.evaluate(permissions_class, model, user_obj, obj)
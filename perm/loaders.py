@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+
+# Python 3.5+ only, this module uses asyncio
+
+import asyncio
+import weakref
+
+from .bulk import has_perm_many
+from .permissions import permissions_manager
+from .utils import call_in_worker
+
+_loaders = weakref.WeakKeyDictionary()
+
+
+class PermLoader(object):
+    """
+    Collect the permission checks that coroutines ask for in the same tick of the event loop, and evaluate them
+    together with has_perm_many() in ``executor`` (None is the default executor of the loop): one cache lookup,
+    and one ``pk__in`` query for each user, model and permission that uses get_queryset_perm_PERM.
+    """
+
+    def __init__(self, loop=None, executor=None):
+        # A weak reference, the loader is the value of its loop in _loaders
+        self._loop = weakref.ref(loop or asyncio.get_event_loop())
+        self.executor = executor
+        # Pending ModelPermissions objects and their futures, keyed by permissions class, model, user, perm and object.
+        # has_perm_many() computes the cache keys in the executor.
+        self._pending = {}
+
+    @property
+    def loop(self):
+        return self._loop()
+
+    def load(self, user_obj, perm, obj):
+        """
+        Return a future for the result of permission ``perm`` for ``user_obj`` on model instance ``obj``
+        """
+        future = self.loop.create_future()
+        permissions = permissions_manager.get_permissions(obj.__class__, user_obj, perm, obj)
+        if permissions is None:
+            future.set_result(False)
+            return future
+        if not self._pending:
+            # Runs after the coroutines that are ready in this tick
+            self.loop.call_soon(self._dispatch)
+        # Not the cache key, it may run queries (e.g. for perm_user_attributes) and this is the event loop thread
+        object_pk = obj.pk if obj.pk is not None else id(obj)
+        key = (permissions.__class__, obj.__class__, getattr(user_obj, 'pk', None), permissions.perm, object_pk)
+        if key in self._pending:
+            self._pending[key][1].append(future)
+        else:
+            self._pending[key] = (permissions, [future])
+        return future
+
+    def _dispatch(self):
+        pending = list(self._pending.values())
+        self._pending = {}
+        self.loop.create_task(self._evaluate(pending))
+
+    async def _evaluate(self, pending):
+        checks = [permissions for permissions, futures in pending]
+        try:
+            results = await self.loop.run_in_executor(self.executor, call_in_worker, has_perm_many, checks)
+        except Exception as e:
+            for permissions, futures in pending:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for (permissions, futures), result in zip(pending, results):
+            for future in futures:
+                if not future.done():
+                    future.set_result(result)
+
+
+def get_perm_loader(loop=None):
+    """
+    Get the PermLoader for ``loop`` (default the current event loop)
+    """
+    loop = loop or asyncio.get_event_loop()
+    loader = _loaders.get(loop)
+    if loader is None:
+        loader = _loaders[loop] = PermLoader(loop)
+    return loader
+
+
+async def has_perm_async(user_obj, perm, obj):
+    """
+    Test permission ``perm`` for ``user_obj`` on ``obj``, batched with the checks of other coroutines
+    """
+    return await get_perm_loader().load(user_obj, perm, obj)
@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...audit import diff_audits, get_audit_units, run_audit
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute the permission matrix (user, object, perm) for models into a gzipped file, '
+        'or compare two such files with --diff.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models', default=[],
+                            help='Model to audit as app_label.ModelName, can be repeated.')
+        parser.add_argument('--perm', action='append', dest='perms', default=[],
+                            help='Permission to audit, can be repeated. Default is all permissions of the model.')
+        parser.add_argument('--user', action='append', dest='users', type=int, default=[],
+                            help='Primary key of a user to audit, can be repeated. Default is all users.')
+        parser.add_argument('--output', help='File to write the audit to.')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of worker processes. Default is the number of CPUs.')
+        parser.add_argument('--chunk-size', type=int, default=100, dest='chunk_size',
+                            help='Number of users per unit of work, and objects per query.')
+        parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'),
+                            help='Show the differences between two audit files.')
+
+    def handle(self, *args, **options):
+        if options['diff']:
+            return self.handle_diff(*options['diff'])
+        if not options['models']:
+            raise CommandError('Specify at least one --model.')
+        if not options['output']:
+            raise CommandError('Specify --output.')
+        units = get_audit_units(
+            options['models'],
+            perms=options['perms'],
+            user_pks=options['users'] or None,
+            chunk_size=options['chunk_size'],
+        )
+        count = run_audit(units, options['output'], processes=options['processes'])
+        self.stdout.write('Wrote {count} rows to {output}.'.format(count=count, output=options['output']))
+
+    def handle_diff(self, old_path, new_path):
+        changes = diff_audits(old_path, new_path)
+        for sign, model_label, perm, user_pk, object_pk in changes:
+            self.stdout.write('{sign} {model} {perm} user={user} object={object}'.format(
+                sign=sign,
+                model=model_label,
+                perm=perm,
+                user=user_pk,
+                object=object_pk,
+            ))
+        self.stdout.write('{count} changes.'.format(count=len(changes)))
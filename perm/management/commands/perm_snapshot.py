@@ -0,0 +1,45 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.six import text_type
+
+from ...audit import get_audit_units
+from ...exceptions import PermException
+from ...snapshot import build_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Precompute the permission matrix (user, object, perm) for models into a snapshot file, '
+        'for use in PERM_SETTINGS["snapshot"].'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models', default=[],
+                            help='Model to include as app_label.ModelName, can be repeated.')
+        parser.add_argument('--perm', action='append', dest='perms', default=[],
+                            help='Permission to include, can be repeated. Default is all permissions of the model.')
+        parser.add_argument('--user', action='append', dest='users', type=int, default=[],
+                            help='Primary key of a user to include, can be repeated. Default is all users.')
+        parser.add_argument('--output', help='Snapshot file, replaced atomically.')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of worker processes. Default is the number of CPUs.')
+        parser.add_argument('--chunk-size', type=int, default=100, dest='chunk_size',
+                            help='Number of users per unit of work, and objects per query.')
+
+    def handle(self, *args, **options):
+        if not options['models']:
+            raise CommandError('Specify at least one --model.')
+        if not options['output']:
+            raise CommandError('Specify --output.')
+        units = get_audit_units(
+            options['models'],
+            perms=options['perms'],
+            user_pks=options['users'] or None,
+            chunk_size=options['chunk_size'],
+        )
+        try:
+            count = build_snapshot(units, options['output'], processes=options['processes'])
+        except PermException as e:
+            raise CommandError(text_type(e))
+        self.stdout.write('Wrote {count} sections to {output}.'.format(count=count, output=options['output']))
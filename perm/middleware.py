@@ -0,0 +1,22 @@
+from __future__ import unicode_literals
+
+from .scope import close_request_scope, open_request_scope
+
+# Support both MIDDLEWARE and MIDDLEWARE_CLASSES
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+
+class PermRequestScopeMiddleware(MiddlewareMixin):
+    """
+    Build each permission queryset once per request, and compile its exists() query once
+    """
+
+    def process_request(self, request):
+        open_request_scope()
+
+    def process_response(self, request, response):
+        close_request_scope()
+        return response
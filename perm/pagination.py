@@ -0,0 +1,119 @@
+from __future__ import unicode_literals
+
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db.models.signals import post_delete, post_save
+from django.utils.functional import cached_property
+from django.utils.six.moves import range
+from django.utils.translation import ugettext_lazy as _
+
+from .cache import bump_generation, cache_get, cache_key, cache_set, get_generation
+from .conf import perm_settings
+from .utils import EmptyResultSet, get_model_label
+
+
+def _bump_generation(sender, **kwargs):
+    bump_generation(sender)
+
+
+def connect_generation_signals(model):
+    """
+    Start a new generation of ``model`` whenever one of its objects is saved or deleted
+    """
+    dispatch_uid = 'perm-generation-{label}'.format(label=get_model_label(model))
+    post_save.connect(_bump_generation, sender=model, weak=False, dispatch_uid=dispatch_uid)
+    post_delete.connect(_bump_generation, sender=model, weak=False, dispatch_uid=dispatch_uid)
+
+
+def get_cached_count(queryset, **key_parts):
+    """
+    Return ``queryset.count()``, cached for PERM_SETTINGS['counts']['expires'] seconds per SQL of the queryset,
+    ``key_parts`` and generation of the model
+    """
+    expires = perm_settings['counts']['expires']
+    if expires is None:
+        return queryset.count()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    key = cache_key(
+        model=get_model_label(queryset.model),
+        generation=get_generation(queryset.model),
+        query='{sql}|{params}'.format(sql=sql, params=params),
+        **key_parts
+    )
+    count = cache_get(key)
+    if count is None:
+        count = queryset.count()
+        cache_set(key, count, expires)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator that caches the count of its queryset, see get_cached_count()
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count_key=None):
+        super(CachedCountPaginator, self).__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.count_key = count_key or {}
+
+    @cached_property
+    def count(self):
+        return get_cached_count(self.object_list, **self.count_key)
+
+
+class HasNextPage(Page):
+    """
+    Page of a HasNextPaginator, it knows if there is a next page without knowing the number of pages
+    """
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super(HasNextPage, self).__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1 if self.object_list else 0
+
+
+class HasNextPaginator(Paginator):
+    """
+    Paginator that never counts: it fetches one object more than a page to find out if there is a next page.
+    ``count`` and ``num_pages`` are None, and there is no last page. ``page_range`` only holds the pages that are
+    known to exist: up to the last page returned by page(), plus the next page if it has one.
+    """
+    count = None
+    num_pages = None
+    # Number of pages known to exist
+    _known_pages = 0
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        object_list = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not object_list and (number > 1 or not self.allow_empty_first_page):
+            raise EmptyPage(_('That page contains no results'))
+        has_next = len(object_list) > self.per_page
+        self._known_pages = number + 1 if has_next else number
+        return HasNextPage(object_list[:self.per_page], number, self, has_next)
+
+    @property
+    def page_range(self):
+        return range(1, self._known_pages + 1)
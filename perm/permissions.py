@@ -1,10 +1,27 @@
 from __future__ import unicode_literals
 
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import BooleanField, Case, Value, When
 from django.utils.translation import ugettext_lazy as _
 
 from perm.cache import cache_get, cache_set, cache_key
-from .exceptions import PermAppException, PermQuerySetNotFound, PermMethodNotFound, PermPrimaryKeyNotFound
-from .utils import get_model_for_perm
+from .conf import perm_settings
+from .debug import trace_record
+from .exceptions import (
+    PermAppException, PermQuerySetNotFound, PermMethodNotFound, PermPrimaryKeyNotFound, PermRuleNotFound,
+    PermTimeoutExceeded
+)
+from .pagination import connect_generation_signals
+from .refresh import refresh_ahead
+from .routing import get_perm_database, using_primary
+from .scope import CompiledExists, get_request_scope
+from .snapshot import snapshot_reader
+from .timeouts import evaluate_within_budget, get_last_known_expires, in_atomic_block
+from .utils import get_model_for_perm, prefetch_related_objects
+
+TIMEOUT_DENY = 'deny'
+TIMEOUT_CACHED = 'cached'
+TIMEOUT_RAISE = 'raise'
 
 
 class ModelPermissionsManager(object):
@@ -15,6 +32,11 @@ class ModelPermissionsManager(object):
 
     def register(self, model, permissions_class):
         model = get_model_for_perm(model)
+        # Rules are compiled once, when they are registered
+        permissions_class.compile_rules(model)
+        if perm_settings['counts']['expires'] is not None:
+            # Writes invalidate the cached counts
+            connect_generation_signals(model)
         self._registry[model] = permissions_class
         return model
 
@@ -22,6 +44,20 @@ class ModelPermissionsManager(object):
         self.register(model, permissions_class)
         return permissions_class
 
+    def get_permissions_class(self, model):
+        """
+        Get the ModelPermissions class registered for ``model``, or None
+        """
+        try:
+            return self._registry[model]
+        except (KeyError, TypeError):
+            # Not a registered model class, but this might be a string or an instance
+            pass
+        model = get_model_for_perm(model)
+        if not isinstance(model, type):
+            model = model.__class__
+        return self._registry.get(model, None)
+
     def get_permissions(self, model, user_obj, perm, obj=None, raise_exception=False):
         model = get_model_for_perm(model)
         permissions_checker_class = self._registry.get(model, None)
@@ -32,6 +68,29 @@ class ModelPermissionsManager(object):
         permissions = permissions_checker_class(model, user_obj, perm, obj)
         return permissions
 
+    def prepare_queryset(self, queryset, *perms):
+        """
+        Apply the related paths that ``perms`` need to ``queryset``
+        """
+        permissions_class = self._registry.get(queryset.model, None)
+        if not permissions_class:
+            return queryset
+        return permissions_class.prepare_queryset(queryset, *perms)
+
+    def prepare_objects(self, objects, *perms):
+        """
+        Prefetch the related paths that ``perms`` need for a list of model instances, return the list
+        """
+        objects = list(objects)
+        by_model = {}
+        for obj in objects:
+            by_model.setdefault(obj.__class__, []).append(obj)
+        for model, instances in by_model.items():
+            permissions_class = self._registry.get(model, None)
+            if permissions_class:
+                permissions_class.prepare_objects(instances, *perms)
+        return objects
+
 
 class ModelPermissions(object):
     """
@@ -46,6 +105,27 @@ class ModelPermissions(object):
     allow_anonymous_user = False
     allow_inactive_user = False
 
+    # Time budget in seconds for all permissions of this class, and per permission
+    time_budget = None
+    perm_time_budgets = {}
+    # Fallback when the budget is exceeded: TIMEOUT_DENY, TIMEOUT_CACHED or TIMEOUT_RAISE
+    time_budget_fallback = None
+
+    # Related paths that the checks for a permission follow on self.obj, e.g. {'wiggle': ['owner']}
+    perm_select_related = {}
+    perm_prefetch_related = {}
+
+    # Declarative rules per permission, e.g. {'change': FieldIsUser('owner') | UserFieldIs('is_staff')}
+    rules = {}
+    _compiled_rules = {}
+
+    # Database alias for permission queries of this class, overrides PERM_SETTINGS['database']
+    database = None
+
+    # User attributes that a permission depends on instead of the user, e.g. {'publish': ['is_staff', 'groups']}.
+    # Results are cached per combination of these values, and shared by all users that have them.
+    perm_user_attributes = {}
+
     def __init__(self, model, user_obj, perm, obj=None, *args, **kwargs):
         """
         Set the properties
@@ -60,26 +140,208 @@ class ModelPermissions(object):
         """
         Get a unique cache key for this object's parameters
         """
+        attributes = self.perm_user_attributes.get(self.perm, None)
         return cache_key(
             model=self.model,
-            user=self.user,
+            user=self.user if attributes is None else self.get_user_role(attributes),
             obj=self.obj,
             perm=self.perm,
         )
 
+    def get_user_role(self, attributes):
+        """
+        Describe the user by the values of ``attributes``, plus authentication and active state, which are always
+        checked. The values of related managers (e.g. groups) are the sorted primary keys, remembered on the user.
+        """
+        user = self.user
+        authenticated = getattr(user, 'pk', None) is not None
+        parts = [
+            'authenticated={value}'.format(value=authenticated),
+            'is_active={value}'.format(value=getattr(user, 'is_active', False)),
+        ]
+        if authenticated:
+            try:
+                values = user._perm_role_values
+            except AttributeError:
+                values = user._perm_role_values = {}
+            for name in attributes:
+                if name not in values:
+                    value = getattr(user, name, None)
+                    if hasattr(value, 'values_list'):
+                        value = sorted(value.values_list('pk', flat=True))
+                    values[name] = value
+                parts.append('{name}={value}'.format(name=name, value=values[name]))
+        return 'role:{parts}'.format(parts=','.join(parts))
+
+    @classmethod
+    def get_perm_names(cls):
+        """
+        Return the sorted names of all permissions this class can check
+        """
+        perm_names = set(cls.rules)
+        for name in dir(cls):
+            for prefix in ('has_perm_', 'get_queryset_perm_'):
+                if name.startswith(prefix) and len(name) > len(prefix):
+                    perm_names.add(name[len(prefix):])
+        return sorted(perm_names)
+
+    @classmethod
+    def compile_rules(cls, model):
+        """
+        Compile the declarative rules of this class for ``model``
+        """
+        cls._compiled_rules = dict((perm, rule.compile(model)) for perm, rule in cls.rules.items())
+
+    @classmethod
+    def get_rule(cls, perm):
+        """
+        Get the CompiledRule for ``perm``, or None
+        """
+        return cls._compiled_rules.get(perm, None)
+
+    @classmethod
+    def get_related_paths(cls, *perms):
+        """
+        Return the select_related and prefetch_related paths needed to check ``perms``
+        """
+        select_related = []
+        prefetch_related = []
+        for perm in perms:
+            rule = cls.get_rule(perm)
+            paths = list(cls.perm_select_related.get(perm, ()))
+            if rule:
+                paths.extend(rule.select_related)
+            for path in paths:
+                if path not in select_related:
+                    select_related.append(path)
+            paths = list(cls.perm_prefetch_related.get(perm, ()))
+            if rule:
+                paths.extend(rule.prefetch_related)
+            for path in paths:
+                if path not in prefetch_related:
+                    prefetch_related.append(path)
+        return select_related, prefetch_related
+
+    @classmethod
+    def prepare_queryset(cls, queryset, *perms):
+        """
+        Apply the related paths needed to check ``perms`` to ``queryset``
+        """
+        select_related, prefetch_related = cls.get_related_paths(*perms)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    @classmethod
+    def prepare_objects(cls, objects, *perms):
+        """
+        Prefetch the related paths needed to check ``perms`` for model instances that are already loaded
+        """
+        select_related, prefetch_related = cls.get_related_paths(*perms)
+        if select_related or prefetch_related:
+            prefetch_related_objects(objects, *(select_related + prefetch_related))
+        return objects
+
+    def get_time_budget(self):
+        """
+        Get the time budget in seconds for this permission, None means no limit
+        """
+        budget = self.perm_time_budgets.get(self.perm)
+        if budget is None:
+            budget = self.time_budget
+        if budget is None:
+            budget = perm_settings['timeouts']['budget']
+        return budget
+
+    def get_time_budget_fallback(self):
+        """
+        Get the fallback for a check that exceeds its time budget
+        """
+        return self.time_budget_fallback or perm_settings['timeouts']['fallback']
+
+    def get_database(self):
+        """
+        Get the database alias for permission queries, None means the default routing
+        """
+        return get_perm_database(self.database, self.model)
+
+    def _get_scope_key(self, kind):
+        return kind, self.__class__, self.model, getattr(self.user, 'pk', None), self.perm, self.get_database()
+
     def get_queryset(self):
         """
-        Get method get_queryset_perm_PERM or return None
+        Get the permission queryset, built once per request scope (see perm.scope)
+        """
+        scope = get_request_scope()
+        if scope is None:
+            return self._get_queryset()
+        key = self._get_scope_key('queryset')
+        queryset = scope.get(key)
+        if queryset is None:
+            queryset = scope[key] = self._get_queryset()
+        # A clone, so that evaluating it does not fill the remembered queryset
+        return queryset.all()
+
+    def _get_queryset(self):
+        """
+        Get method get_queryset_perm_PERM, or the queryset for the rule for PERM
         """
         try:
             method = getattr(self, 'get_queryset_perm_%s' % self.perm)
         except AttributeError:
-            raise PermQuerySetNotFound(_('Permissions for %(model)s do not include queryset for %(perm)s.' % {
-                'model': self.model,
-                'perm': self.perm
-            }))
-        # No need for self parameter, Python knows it is a method
-        return method()
+            rule = self.get_rule(self.perm)
+            if not rule:
+                raise PermQuerySetNotFound(_('Permissions for %(model)s do not include queryset for %(perm)s.' % {
+                    'model': self.model,
+                    'perm': self.perm
+                }))
+            if self._check_user():
+                queryset = self.model._default_manager.filter(rule.get_q(self.user))
+            else:
+                # Same answer as _has_perm() for anonymous and inactive users
+                queryset = self.model._default_manager.none()
+        else:
+            # No need for self parameter, Python knows it is a method
+            queryset = method()
+        database = self.get_database()
+        if database is not None:
+            queryset = queryset.using(database)
+        return queryset
+
+    def get_user_queryset(self, users):
+        """
+        Get the users in queryset ``users`` that have PERM on obj,
+        using method get_user_queryset_perm_PERM(users) or the rule for PERM
+        """
+        try:
+            method = getattr(self, 'get_user_queryset_perm_%s' % self.perm)
+        except AttributeError:
+            rule = self.get_rule(self.perm)
+            # Methods come first, as in _has_perm()
+            if not rule or hasattr(self, 'has_perm_%s' % self.perm) or (rule.uses_obj and self.obj is None):
+                raise PermQuerySetNotFound(
+                    _('Permissions for %(model)s do not include user queryset for %(perm)s.') % {
+                        'model': self.model,
+                        'perm': self.perm
+                    }
+                )
+            users = users.filter(rule.get_user_q(self.obj))
+        else:
+            users = method(users)
+        # Same as _check_user(), users in a queryset are never anonymous
+        if not self.allow_inactive_user:
+            try:
+                users.model._meta.get_field('is_active')
+            except FieldDoesNotExist:
+                pass
+            else:
+                users = users.filter(is_active=True)
+        database = self.get_database()
+        if database is not None:
+            users = users.using(database)
+        return users
 
     def _has_perm_using_method(self):
         """
@@ -95,6 +357,39 @@ class ModelPermissions(object):
         # No need for self parameter, Python knows it is a method
         return method()
 
+    def _has_perm_using_rule(self):
+        """
+        Test the rule for PERM on the object in memory
+        """
+        rule = self.get_rule(self.perm)
+        # Rules that look at the object cannot say anything about a model class
+        if not rule or (rule.uses_obj and self.obj is None):
+            raise PermRuleNotFound(_('Permissions for %(model)s do not include rule for %(perm)s.') % {
+                'model': self.model,
+                'perm': self.perm
+            })
+        return rule.check(self.user, self.obj, self.get_database())
+
+    def _bulk_has_perm_using_rule(self, queryset):
+        """
+        Return a list with the result of the rule for PERM for each object in ``queryset``, using one query
+        """
+        rule = self.get_rule(self.perm)
+        # Methods come first, as in _has_perm()
+        if not rule or hasattr(self, 'has_perm_%s' % self.perm):
+            raise PermRuleNotFound(_('Permissions for %(model)s do not include rule for %(perm)s.') % {
+                'model': self.model,
+                'perm': self.perm
+            })
+        if not self._check_user():
+            return [False for obj in queryset]
+        queryset = queryset.annotate(perm_result=Case(
+            When(rule.get_q(self.user), then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        ))
+        return [obj.perm_result for obj in queryset]
+
     def _has_perm_using_queryset(self):
         """
         Test to see if obj appears in get_perm_PERM_queryset()
@@ -115,45 +410,148 @@ class ModelPermissions(object):
                 ))
             )
 
+        # In a request scope, compile the SQL once and run it for every object
+        scope = get_request_scope()
+        if scope is not None:
+            key = self._get_scope_key('exists')
+            if key not in scope:
+                scope[key] = CompiledExists.compile(qs, pk)
+            if scope[key] is not None:
+                return scope[key](pk)
+
         # Math the object with the queryset
         return qs.filter(pk=pk).exists()
 
-    def _has_perm(self):
+    def _check_user(self):
         """
-        Test using direct method and queryset
+        Test for empty, anonymous and inactive users
         """
-
-        # Check empty, anonymous and inactive users
         if not self.allow_anonymous_user or not self.allow_inactive_user:
             if not self.user or self.user.pk is None:
+                trace_record(path='anonymous user')
                 return False
             if not self.allow_inactive_user and not self.user.is_active:
+                trace_record(path='inactive user')
                 return False
+        return True
+
+    def _has_perm(self):
+        """
+        Test using direct method, rule and queryset
+        """
+
+        # Check empty, anonymous and inactive users
+        if not self._check_user():
+            return False
 
         # Try using method, move on if no method is defined
         try:
-            return self._has_perm_using_method()
+            result = self._has_perm_using_method()
         except PermMethodNotFound:
             pass
+        else:
+            trace_record(path='method')
+            return result
+
+        # Try using rule, move on if no rule is defined
+        try:
+            result = self._has_perm_using_rule()
+        except PermRuleNotFound:
+            pass
+        else:
+            trace_record(path='rule')
+            return result
 
         # Try using queryset, forgive lacking QS or PK by eventually returning False
         try:
-            return self._has_perm_using_queryset()
+            result = self._has_perm_using_queryset()
         except (PermQuerySetNotFound, PermPrimaryKeyNotFound):
             pass
+        else:
+            trace_record(path='queryset')
+            return result
 
         # Deny permission
+        trace_record(path='denied')
         return False
 
+    def _has_perm_within_budget(self, cache_key, budget):
+        """
+        Test using _has_perm(), but never wait longer than ``budget`` seconds.
+        Returns a tuple (result, cacheable), results of checks that exceeded the budget are not cacheable.
+        """
+        last_known_key = '{cache_key}-LAST'.format(cache_key=cache_key)
+        try:
+            result = evaluate_within_budget(self, budget)
+        except PermTimeoutExceeded:
+            fallback = self.get_time_budget_fallback()
+            if fallback == TIMEOUT_RAISE:
+                raise
+            if fallback == TIMEOUT_CACHED:
+                return bool(cache_get(last_known_key, False)), False
+            return False, False
+        if self.get_time_budget_fallback() == TIMEOUT_CACHED:
+            # Remember the last known value, it outlives the regular cache entry
+            cache_set(last_known_key, result, expires=get_last_known_expires())
+        return result, True
+
+    def _evaluate(self, cache_key):
+        """
+        Test for permission without looking in the cache, return a tuple (result, cacheable)
+        """
+        budget = self.get_time_budget()
+        # A pool thread has its own connection, it cannot see the writes of a transaction of this thread
+        if budget is not None and not in_atomic_block():
+            trace_record(path='budget', time_budget=budget)
+            return self._has_perm_within_budget(cache_key, budget)
+        return self._has_perm(), True
+
+    def _lookup_snapshot(self):
+        """
+        Get the result from the snapshot, None if there is no snapshot or it does not know
+        """
+        if not perm_settings['snapshot']['path']:
+            return None
+        result = snapshot_reader.lookup(self.model, self.perm, self.user, self.obj)
+        if result is not None:
+            trace_record(path='snapshot')
+        return result
+
+    def _can_batch_queryset(self):
+        """
+        Return True if this check would be done by _has_perm_using_queryset(), so that it can be
+        batched with checks for other objects
+        """
+        if getattr(self.obj, 'pk', None) is None or self.get_time_budget() is not None:
+            return False
+        if hasattr(self, 'has_perm_%s' % self.perm) or self.get_rule(self.perm) is not None:
+            return False
+        if not hasattr(self, 'get_queryset_perm_%s' % self.perm):
+            return False
+        return self._check_user()
+
     def has_perm(self):
         """
         Test for permission
         """
+        primary = using_primary()
+        result = None if primary else self._lookup_snapshot()
+        if result is not None:
+            return result
         cache_key = self.get_cache_key()
-        result = cache_get(cache_key)
+        result = None if primary else cache_get(cache_key)
+        trace_record(
+            permissions_class='{module}.{name}'.format(module=self.__class__.__module__, name=self.__class__.__name__),
+            cache_key=cache_key,
+            cache_hit=result is not None,
+        )
         if result is None:
-            result = self._has_perm()
-            cache_set(cache_key, result)
+            result, cacheable = self._evaluate(cache_key)
+            if cacheable:
+                cache_set(cache_key, result)
+                refresh_ahead.record_set(cache_key)
+        else:
+            refresh_ahead.record_hit(cache_key, self)
         return result
 
 
@@ -0,0 +1,143 @@
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.signals import request_finished
+from django.db import close_old_connections
+
+from .cache import cache_set
+from .conf import perm_settings
+from .utils import BoundedCache, call_in_worker
+
+REFRESH_THREAD = 'thread'
+REFRESH_RESPONSE = 'response'
+
+_local = threading.local()
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshAhead(object):
+    """
+    Singleton object that counts the hits on permission cache keys in this process, and evaluates keys that are
+    hot and about to expire again before they do. See PERM_SETTINGS['refresh'].
+    """
+    _lock = threading.Lock()
+
+    def __init__(self):
+        # Cache key: [set at, expires, hits since set, refresh scheduled]
+        self._entries = BoundedCache(perm_settings['refresh']['max_keys'])
+        self._executor = None
+        self._pending = 0
+
+    def get_mode(self):
+        return perm_settings['refresh']['mode']
+
+    def record_set(self, key, expires=None):
+        """
+        Remember when ``key`` was set, ``expires`` defaults to PERM_SETTINGS['cache']['expires']
+        """
+        if not self.get_mode():
+            return
+        if expires is None:
+            expires = perm_settings['cache']['expires']
+        with self._lock:
+            self._entries.set(key, [time.time(), expires, 0, False])
+
+    def record_hit(self, key, permissions):
+        """
+        Count a hit on ``key`` and schedule a refresh of ``permissions`` if the key is hot and about to expire
+        """
+        if not self.get_mode():
+            return
+        refresh_settings = perm_settings['refresh']
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # Set by another process, or before the entries started over
+                return
+            entry[2] += 1
+            set_at, expires, hits, scheduled = entry
+            if scheduled or not expires or hits < refresh_settings['hits']:
+                return
+            if time.time() < set_at + expires * (1 - refresh_settings['ahead']):
+                return
+            entry[3] = True
+        self.schedule(key, permissions)
+
+    def schedule(self, key, permissions):
+        if self.get_mode() == REFRESH_RESPONSE:
+            # Run by the request_finished signal, after the response has been sent
+            if not hasattr(_local, 'refreshes'):
+                _local.refreshes = {}
+            _local.refreshes[key] = permissions
+            return
+        with self._lock:
+            if self._pending >= perm_settings['refresh']['max_pending']:
+                # Too much to do, let this key expire as usual
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry[3] = False
+                return
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=perm_settings['refresh']['workers'])
+        self._executor.submit(self._refresh_in_thread, key, permissions)
+
+    def refresh(self, key, permissions):
+        """
+        Evaluate ``permissions`` and store the result under ``key``
+        """
+        result, cacheable = permissions._evaluate(key)
+        if cacheable:
+            cache_set(key, result)
+            self.record_set(key)
+
+    def _refresh_logged(self, key, permissions):
+        """
+        Refresh, but only log errors: nobody is waiting for the result
+        """
+        try:
+            self.refresh(key, permissions)
+        except Exception:
+            logger.exception('Cannot refresh permission cache key %s', key)
+
+    def _refresh_in_thread(self, key, permissions):
+        try:
+            call_in_worker(self._refresh_logged, key, permissions)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def run_response_refreshes(self):
+        """
+        Refresh the keys that were scheduled by this thread
+        """
+        refreshes = getattr(_local, 'refreshes', None)
+        if not refreshes:
+            return
+        _local.refreshes = {}
+        for key, permissions in refreshes.items():
+            # Errors must not reach the server that closes the response
+            self._refresh_logged(key, permissions)
+        # Django closed the connections of this request before, close them again like it does
+        close_old_connections()
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+        _local.refreshes = {}
+
+
+# Instantiate the singleton
+refresh_ahead = RefreshAhead()
+
+
+def _run_response_refreshes(sender, **kwargs):
+    refresh_ahead.run_response_refreshes()
+
+
+request_finished.connect(_run_response_refreshes, dispatch_uid='perm-refresh-ahead')
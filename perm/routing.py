@@ -0,0 +1,46 @@
+from __future__ import unicode_literals
+
+import threading
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, router
+
+from .conf import perm_settings
+
+_local = threading.local()
+
+
+@contextmanager
+def use_primary():
+    """
+    Run permission queries in this thread on the default database, e.g. to read your own writes.
+    Results in the snapshot or the cache may come from a replica, so they are skipped; fresh results are cached.
+    """
+    previous = getattr(_local, 'use_primary', False)
+    _local.use_primary = True
+    try:
+        yield
+    finally:
+        _local.use_primary = previous
+
+
+def using_primary():
+    """
+    Return True within use_primary(), where results are not read from the snapshot or the cache
+    """
+    return getattr(_local, 'use_primary', False)
+
+
+def get_perm_database(database=None, model=None):
+    """
+    Get the database alias for permission queries, None means the default routing of Django.
+    ``database`` is the alias preferred by a ModelPermissions class, if any. Within use_primary() this is the
+    database that Django writes ``model`` to, so that a router that sends reads to a replica is bypassed too.
+    """
+    if using_primary():
+        if model is None:
+            return DEFAULT_DB_ALIAS
+        return router.db_for_write(model)
+    if database is None:
+        database = perm_settings['database']
+    return database
@@ -0,0 +1,312 @@
+from __future__ import unicode_literals
+
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.translation import ugettext_lazy as _
+
+from .exceptions import PermException
+
+
+def _match_all():
+    return Q(pk__isnull=False)
+
+
+def _match_none():
+    return Q(pk__in=[])
+
+
+class CompiledRule(object):
+    """
+    A rule compiled for a model: ``check(user, obj, using=None)`` for loaded objects, ``get_q(user)`` for querysets
+    of the model and ``get_user_q(obj)`` for querysets of users
+    """
+
+    def __init__(self, check, get_q, get_user_q, uses_obj=True, select_related=(), prefetch_related=()):
+        self.check = check
+        self.get_q = get_q
+        self.get_user_q = get_user_q
+        self.uses_obj = uses_obj
+        self.select_related = list(select_related)
+        self.prefetch_related = list(prefetch_related)
+
+
+class Rule(object):
+    """
+    Base class for declarative rules, combine rules with ``&``, ``|`` and ``~``
+    """
+
+    def compile(self, model):
+        """
+        Return a CompiledRule for ``model``
+        """
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return All(self, other)
+
+    def __or__(self, other):
+        return Any(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+
+class _FieldRule(Rule):
+    """
+    Base class for rules on a field of the object, ``path`` may follow foreign keys, e.g. 'project__owner'
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def resolve(self, model):
+        """
+        Return the fields along ``path``, all but the last one must be forward foreign keys
+        """
+        fields = []
+        for name in self.path.split(LOOKUP_SEP):
+            if fields:
+                model = fields[-1].related_model
+            field = model._meta.get_field(name)
+            fields.append(field)
+        for field in fields[:-1]:
+            if not (field.concrete and (field.many_to_one or field.one_to_one)):
+                raise PermException(_('Rule path %(path)s can only follow foreign keys.') % {'path': self.path})
+        return fields
+
+    def get_select_related(self, fields):
+        if len(fields) > 1:
+            return [LOOKUP_SEP.join(field.name for field in fields[:-1])]
+        return []
+
+
+def _follow(obj, fields):
+    """
+    Follow the foreign keys in ``fields`` from ``obj``
+    """
+    for field in fields:
+        if obj is None:
+            break
+        obj = getattr(obj, field.name)
+    return obj
+
+
+class FieldIsUser(_FieldRule):
+    """
+    The foreign key at ``path`` points to the user
+    """
+
+    def compile(self, model):
+        fields = self.resolve(model)
+        last = fields[-1]
+        if not (last.concrete and (last.many_to_one or last.one_to_one)):
+            raise PermException(_('Rule path %(path)s must end in a foreign key.') % {'path': self.path})
+        path = self.path
+
+        def check(user, obj, using=None):
+            parent = _follow(obj, fields[:-1])
+            # Compare the raw value, there is no need to load the user
+            return parent is not None and user.pk is not None and getattr(parent, last.attname) == user.pk
+
+        def get_q(user):
+            if user.pk is None:
+                return _match_none()
+            return Q(**{path: user.pk})
+
+        def get_user_q(obj):
+            parent = _follow(obj, fields[:-1])
+            user_pk = getattr(parent, last.attname) if parent is not None else None
+            if user_pk is None:
+                return _match_none()
+            return Q(pk=user_pk)
+
+        return CompiledRule(check, get_q, get_user_q, select_related=self.get_select_related(fields))
+
+
+class UserInField(_FieldRule):
+    """
+    The user is a member of the many to many relation at ``path``
+    """
+
+    def compile(self, model):
+        fields = self.resolve(model)
+        last = fields[-1]
+        if not last.many_to_many:
+            raise PermException(_('Rule path %(path)s must end in a many to many relation.') % {'path': self.path})
+        accessor = last.name if last.concrete else last.get_accessor_name()
+        # Name of the relation as seen from the user model
+        user_path = last.related_query_name() if last.concrete else last.field.name
+        path = self.path
+
+        def check(user, obj, using=None):
+            parent = _follow(obj, fields[:-1])
+            if parent is None or user.pk is None:
+                return False
+            manager = getattr(parent, accessor)
+            prefetched = getattr(parent, '_prefetched_objects_cache', {})
+            if manager.prefetch_cache_name in prefetched:
+                return any(member.pk == user.pk for member in prefetched[manager.prefetch_cache_name])
+            # Without an alias the related manager routes the query, with the instance as hint
+            queryset = manager.all() if using is None else manager.using(using)
+            return queryset.filter(pk=user.pk).exists()
+
+        def get_q(user):
+            if user.pk is None:
+                return _match_none()
+            # A subquery avoids duplicate rows from the join
+            return Q(pk__in=model._default_manager.filter(**{path: user.pk}).values('pk'))
+
+        def get_user_q(obj):
+            parent = _follow(obj, fields[:-1])
+            if parent is None:
+                return _match_none()
+            return Q(pk__in=last.related_model._default_manager.filter(**{user_path: parent.pk}).values('pk'))
+
+        return CompiledRule(
+            check, get_q, get_user_q, select_related=self.get_select_related(fields), prefetch_related=[self.path]
+        )
+
+
+class FieldIs(_FieldRule):
+    """
+    The field at ``path`` has ``value``, e.g. FieldIs('is_published')
+    """
+
+    def __init__(self, path, value=True):
+        super(FieldIs, self).__init__(path)
+        self.value = value
+
+    def compile(self, model):
+        fields = self.resolve(model)
+        last = fields[-1]
+        path = self.path
+        value = self.value
+
+        def check(user, obj, using=None):
+            parent = _follow(obj, fields[:-1])
+            return parent is not None and getattr(parent, last.attname) == value
+
+        def get_q(user):
+            return Q(**{path: value})
+
+        def get_user_q(obj):
+            return _match_all() if check(None, obj) else _match_none()
+
+        return CompiledRule(check, get_q, get_user_q, select_related=self.get_select_related(fields))
+
+
+class UserFieldIs(Rule):
+    """
+    The attribute ``name`` of the user has ``value``, e.g. UserFieldIs('is_staff')
+    """
+
+    def __init__(self, name, value=True):
+        self.name = name
+        self.value = value
+
+    def compile(self, model):
+        name = self.name
+        value = self.value
+
+        def check(user, obj, using=None):
+            return getattr(user, name, None) == value
+
+        def get_q(user):
+            return _match_all() if check(user, None) else _match_none()
+
+        def get_user_q(obj):
+            return Q(**{name: value})
+
+        return CompiledRule(check, get_q, get_user_q, uses_obj=False)
+
+
+class _CompositeRule(Rule):
+
+    def __init__(self, *rules):
+        self.rules = rules
+
+    def compile_children(self, model):
+        compiled = [rule.compile(model) for rule in self.rules]
+        select_related = []
+        prefetch_related = []
+        for child in compiled:
+            select_related.extend(path for path in child.select_related if path not in select_related)
+            prefetch_related.extend(path for path in child.prefetch_related if path not in prefetch_related)
+        uses_obj = any(child.uses_obj for child in compiled)
+        return compiled, uses_obj, select_related, prefetch_related
+
+
+class All(_CompositeRule):
+    """
+    All rules apply, same as ``rule1 & rule2``
+    """
+
+    def compile(self, model):
+        compiled, uses_obj, select_related, prefetch_related = self.compile_children(model)
+
+        def check(user, obj, using=None):
+            return all(child.check(user, obj, using) for child in compiled)
+
+        def get_q(user):
+            q = _match_all()
+            for child in compiled:
+                q &= child.get_q(user)
+            return q
+
+        def get_user_q(obj):
+            q = _match_all()
+            for child in compiled:
+                q &= child.get_user_q(obj)
+            return q
+
+        return CompiledRule(check, get_q, get_user_q, uses_obj, select_related, prefetch_related)
+
+
+class Any(_CompositeRule):
+    """
+    At least one of the rules applies, same as ``rule1 | rule2``
+    """
+
+    def compile(self, model):
+        compiled, uses_obj, select_related, prefetch_related = self.compile_children(model)
+
+        def check(user, obj, using=None):
+            return any(child.check(user, obj, using) for child in compiled)
+
+        def get_q(user):
+            q = _match_none()
+            for child in compiled:
+                q |= child.get_q(user)
+            return q
+
+        def get_user_q(obj):
+            q = _match_none()
+            for child in compiled:
+                q |= child.get_user_q(obj)
+            return q
+
+        return CompiledRule(check, get_q, get_user_q, uses_obj, select_related, prefetch_related)
+
+
+class Not(_CompositeRule):
+    """
+    The rule does not apply, same as ``~rule``
+    """
+
+    def __init__(self, rule):
+        super(Not, self).__init__(rule)
+
+    def compile(self, model):
+        compiled, uses_obj, select_related, prefetch_related = self.compile_children(model)
+        child = compiled[0]
+
+        def check(user, obj, using=None):
+            return not child.check(user, obj, using)
+
+        def get_q(user):
+            return ~child.get_q(user)
+
+        def get_user_q(obj):
+            return ~child.get_user_q(obj)
+
+        return CompiledRule(check, get_q, get_user_q, uses_obj, select_related, prefetch_related)
@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+
+import threading
+from contextlib import contextmanager
+
+from django.db import connections
+from django.utils.six import integer_types
+
+from .utils import EmptyResultSet
+
+_local = threading.local()
+
+
+def open_request_scope():
+    """
+    Start remembering permission querysets in this thread, see PermRequestScopeMiddleware
+    """
+    _local.scope = {}
+
+
+def close_request_scope():
+    _local.scope = None
+
+
+@contextmanager
+def request_scope():
+    """
+    Remember permission querysets in this thread until the block ends, e.g. in a task that checks many objects
+    """
+    previous = getattr(_local, 'scope', None)
+    open_request_scope()
+    try:
+        yield
+    finally:
+        _local.scope = previous
+
+
+def get_request_scope():
+    """
+    Get the dict of the current request scope, or None if there is none
+    """
+    return getattr(_local, 'scope', None)
+
+
+class CompiledExists(object):
+    """
+    The SQL of ``queryset.filter(pk=pk).exists()``, compiled once and run for any pk as a bound parameter
+    """
+
+    def __init__(self, sql, params, index, using):
+        self.sql = sql
+        self.params = params
+        self.index = index
+        self.using = using
+
+    @classmethod
+    def compile(cls, queryset, pk):
+        """
+        Return a CompiledExists for ``queryset``, or None if it cannot be compiled this way.
+        The queryset is compiled for two primary keys, the only parameter that differs is the primary key.
+        """
+        if not isinstance(pk, integer_types) or isinstance(pk, bool):
+            return None
+        using = queryset.db
+        try:
+            sql, params = cls._as_sql(queryset, pk, using)
+            other_sql, other_params = cls._as_sql(queryset, pk + 1, using)
+        except EmptyResultSet:
+            return EMPTY_EXISTS
+        if sql != other_sql or len(params) != len(other_params):
+            return None
+        indexes = [index for index, param in enumerate(params) if param != other_params[index]]
+        if len(indexes) != 1 or params[indexes[0]] != pk:
+            return None
+        return cls(sql, list(params), indexes[0], using)
+
+    @staticmethod
+    def _as_sql(queryset, pk, using):
+        query = queryset.filter(pk=pk).values('pk')[:1].query
+        return query.get_compiler(using=using).as_sql()
+
+    def __call__(self, pk):
+        params = list(self.params)
+        params[self.index] = pk
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(self.sql, params)
+            return cursor.fetchone() is not None
+
+
+class _EmptyExists(object):
+    """
+    Compiled exists() for a queryset that can never match, e.g. ``none()``
+    """
+
+    def __call__(self, pk):
+        return False
+
+
+EMPTY_EXISTS = _EmptyExists()
@@ -1,6 +1,19 @@
 from __future__ import unicode_literals
 
+from collections import namedtuple
+
+from django.contrib.auth import get_user_model
+
+from .bulk import get_perms_for_object, has_perm_many
+from .cache import bump_generation
+from .conf import perm_settings
+from .exceptions import PermQuerySetNotFound
 from .permissions import permissions_manager
+from .routing import use_primary
+from .utils import iter_chunks_by_pk
+
+# Result of perm_update and perm_delete
+PermBulkResult = namedtuple('PermBulkResult', ['affected', 'denied'])
 
 
 def get_perm_queryset(model, user, perm):
@@ -9,3 +22,178 @@ def get_perm_queryset(model, user, perm):
     """
     permissions = permissions_manager.get_permissions(model, user, perm, raise_exception=True)
     return permissions.get_queryset()
+
+
+def iter_perm_queryset(model, user, perm, chunk_size=1000, pks_only=False, values=None):
+    """
+    Iterate over the ``model`` objects for which ``user`` has permission ``perm``, in order of primary key.
+    Objects are fetched ``chunk_size`` at a time, each chunk continues after the last primary key of the previous
+    one, so memory use is bounded and there is no OFFSET.
+    If ``pks_only`` is set, yield primary keys. If ``values`` is a list of field names, yield dicts as
+    ``values()`` does, these always include ``pk``.
+    """
+    queryset = get_perm_queryset(model, user, perm)
+    if pks_only:
+        chunks = iter_chunks_by_pk(queryset.values_list('pk', flat=True), chunk_size, get_pk=lambda pk: pk)
+    elif values is not None:
+        chunks = iter_chunks_by_pk(queryset.values('pk', *values), chunk_size, get_pk=lambda row: row['pk'])
+    else:
+        chunks = iter_chunks_by_pk(queryset, chunk_size)
+    for chunk in chunks:
+        for row in chunk:
+            yield row
+
+
+def users_with_perm(obj, perm, users_qs=None, chunk_size=1000):
+    """
+    Iterate over the users in ``users_qs`` (default all users) that have permission ``perm`` on ``obj``,
+    as checked by the registered ModelPermissions class.
+    Uses one query if the class has a method get_user_queryset_perm_PERM(users), or a rule for ``perm``.
+    Otherwise users are checked ``chunk_size`` at a time, with one cache lookup per chunk.
+    """
+    if users_qs is None:
+        users_qs = get_user_model()._default_manager.all()
+    permissions = permissions_manager.get_permissions(obj.__class__, None, perm, obj, raise_exception=True)
+    try:
+        users = permissions.get_user_queryset(users_qs)
+    except PermQuerySetNotFound:
+        pass
+    else:
+        for user in users.iterator():
+            yield user
+        return
+
+    # Check users one by one, a chunk at a time
+    permissions_class = permissions.__class__
+    for chunk in iter_chunks_by_pk(users_qs, chunk_size):
+        checks = [permissions_class(obj.__class__, user, perm, obj) for user in chunk]
+        for user, result in zip(chunk, has_perm_many(checks)):
+            if result:
+                yield user
+
+
+def _get_allowed_queryset(queryset, user, perm):
+    """
+    Return ``queryset`` restricted to the objects for which ``user`` has ``perm``, with the permission queryset
+    folded into its WHERE clause. Return None if ``perm`` needs a has_perm_PERM method for each object.
+    """
+    permissions = permissions_manager.get_permissions(queryset.model, user, perm, raise_exception=True)
+    if hasattr(permissions, 'has_perm_%s' % perm):
+        return None
+    if not permissions._check_user():
+        return queryset.none()
+    # Writes go to the default database, the permission queryset must be on the same database
+    with use_primary():
+        try:
+            perm_qs = permissions.get_queryset()
+        except PermQuerySetNotFound:
+            return queryset.none()
+    try:
+        return queryset & perm_qs
+    except AssertionError:
+        # Querysets that cannot be combined, e.g. with different distinct fields
+        return queryset.filter(pk__in=perm_qs.values('pk'))
+
+
+def _iter_allowed_chunks(queryset, user, perm, chunk_size):
+    """
+    Yield (allowed pks, denied count) for each chunk of ``queryset``, checking each object
+    """
+    permissions_class = permissions_manager.get_permissions_class(queryset.model)
+    for chunk in iter_chunks_by_pk(queryset, chunk_size):
+        checks = [permissions_class(queryset.model, user, perm, obj) for obj in chunk]
+        results = has_perm_many(checks)
+        yield [obj.pk for obj, result in zip(chunk, results) if result], results.count(False)
+
+
+def _bump_generation(model, affected):
+    # Updates do not send signals, invalidate the cached counts here
+    if affected and perm_settings['counts']['expires'] is not None:
+        bump_generation(model)
+
+
+def perm_update(queryset, user, perm, chunk_size=1000, **values):
+    """
+    Update the objects in ``queryset`` for which ``user`` has permission ``perm`` with ``values``,
+    and return a PermBulkResult with the number of updated and denied objects.
+    With a rule or get_queryset_perm_PERM this takes two queries: a count and one UPDATE.
+    A has_perm_PERM method checks the objects ``chunk_size`` at a time, with an UPDATE for each chunk.
+    """
+    allowed = _get_allowed_queryset(queryset, user, perm)
+    if allowed is not None:
+        total = queryset.count()
+        affected = allowed.update(**values)
+        _bump_generation(queryset.model, affected)
+        return PermBulkResult(affected, total - affected)
+    affected = denied = 0
+    for pks, chunk_denied in _iter_allowed_chunks(queryset, user, perm, chunk_size):
+        if pks:
+            affected += queryset.model._default_manager.filter(pk__in=pks).update(**values)
+        denied += chunk_denied
+    _bump_generation(queryset.model, affected)
+    return PermBulkResult(affected, denied)
+
+
+def perm_delete(queryset, user, perm='delete', chunk_size=1000):
+    """
+    Delete the objects in ``queryset`` for which ``user`` has permission ``perm``,
+    and return a PermBulkResult with the number of deleted and denied objects (not counting cascades).
+    Like perm_update, but Django may still load objects to delete related objects or send signals.
+    """
+    # Counted before deleting, QuerySet.delete() returns no counts in Django < 1.9
+    allowed = _get_allowed_queryset(queryset, user, perm)
+    if allowed is not None:
+        total = queryset.count()
+        affected = allowed.count()
+        allowed.delete()
+        return PermBulkResult(affected, total - affected)
+    affected = denied = 0
+    for pks, chunk_denied in _iter_allowed_chunks(queryset, user, perm, chunk_size):
+        if pks:
+            queryset.model._default_manager.filter(pk__in=pks).delete()
+            affected += len(pks)
+        denied += chunk_denied
+    return PermBulkResult(affected, denied)
+
+
+class ObjectPermissions(object):
+    """
+    Lazy proxy for the permissions of ``user`` on ``obj``, e.g. ``perms.change`` or ``perms['change']``.
+    All registered permissions are checked together on first access, and remembered after that.
+    """
+
+    def __init__(self, user, obj):
+        self._user = user
+        self._obj = obj
+        self._perms = None
+
+    def _get_perms(self):
+        if self._perms is None:
+            user = self._user
+            if user and user.is_active and user.is_superuser:
+                # Active superusers have all permissions, as in ``User.has_perm``
+                self._perms = {}
+            else:
+                self._perms = get_perms_for_object(user, self._obj)
+        return self._perms
+
+    def __getitem__(self, perm):
+        perms = self._get_perms()
+        try:
+            return perms[perm]
+        except KeyError:
+            # Not registered, ask the user (and thereby all authentication backends)
+            perms[perm] = bool(self._user and self._user.has_perm(perm, self._obj))
+            return perms[perm]
+
+    def __getattr__(self, perm):
+        if perm.startswith('_'):
+            raise AttributeError(perm)
+        return self[perm]
+
+
+def get_object_perms(user, obj):
+    """
+    Return a lazy ObjectPermissions proxy for the permissions of ``user`` on ``obj``
+    """
+    return ObjectPermissions(user, obj)
@@ -0,0 +1,271 @@
+from __future__ import unicode_literals
+
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.contrib.auth import get_user_model
+from django.db.models import AutoField, IntegerField
+from django.utils.six import integer_types
+
+from .conf import perm_settings
+from .exceptions import PermException
+from .utils import get_model_for_perm, get_model_label
+
+SNAPSHOT_MAGIC = b'PERMSNP1'
+# Magic, header length and padding, all arrays start at a multiple of 8 bytes
+_PREFIX = struct.Struct('<8sII')
+_ID = struct.Struct('<q')
+_BYTE = struct.Struct('<B')
+
+# Atomic rename that replaces an existing file, os.rename() does that on POSIX in Python 2
+_replace = getattr(os, 'replace', os.rename)
+
+logger = logging.getLogger(__name__)
+
+
+def _align(size):
+    return (size + 7) // 8 * 8
+
+
+class _IdArray(object):
+    """
+    Sequence of ``length`` 64 bit ids at ``offset`` in ``buffer``, read in place (memoryview.cast() is Python 3 only)
+    """
+
+    def __init__(self, buffer, offset, length):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return _ID.unpack_from(self.buffer, self.offset + index * _ID.size)[0]
+
+
+def _has_integer_pk(model):
+    pk = model._meta.pk
+    # The primary key of a child model is a relation to its parent
+    while pk.is_relation:
+        pk = pk.target_field
+    return isinstance(pk, (AutoField, IntegerField))
+
+
+def check_snapshot_models(models):
+    """
+    Raise PermException if one of ``models`` cannot be in a snapshot, which stores primary keys as 64 bit integers
+    """
+    for model in models:
+        if not _has_integer_pk(model):
+            raise PermException('{model} cannot be in a permission snapshot, its primary key is not an integer.'.format(
+                model=get_model_label(model),
+            ))
+
+
+def build_snapshot(units, path, processes=None):
+    """
+    Compute the permission matrix for ``units`` (see perm.audit.get_audit_units) and write it to ``path``.
+    The file is written next to ``path`` and then renamed, so readers always see a complete snapshot.
+    Return the number of sections (model and perm) in the snapshot.
+    """
+    # The audit needs the permissions module, which needs this module
+    from .audit import compute_audit
+
+    # Fail before the work is done
+    models = dict(
+        (model_label, get_model_for_perm(model_label, raise_exception=True))
+        for model_label in set(unit[0] for unit in units)
+    )
+    check_snapshot_models([get_user_model()] + list(models.values()))
+
+    # The objects before the audit: an object that is created during the audit is not in the snapshot, and is
+    # checked live, instead of being denied for everyone
+    object_pks_by_model = dict(
+        (model_label, sorted(model._default_manager.values_list('pk', flat=True)))
+        for model_label, model in models.items()
+    )
+    object_index_by_model = dict(
+        (model_label, dict((pk, index) for index, pk in enumerate(object_pks)))
+        for model_label, object_pks in object_pks_by_model.items()
+    )
+
+    # Collect the allowed objects per section and user
+    sections = {}
+    for rows in compute_audit(units, processes):
+        for model_label, perm, user_pk, object_pks in rows:
+            sections.setdefault((model_label, perm), {})[user_pk] = set(object_pks)
+
+    body = bytearray()
+    header_sections = []
+    for (model_label, perm), allowed in sorted(sections.items()):
+        object_pks = object_pks_by_model[model_label]
+        object_index = object_index_by_model[model_label]
+        user_pks = sorted(allowed)
+        row_bytes = _align((len(object_pks) + 7) // 8)
+        section = {
+            'model': model_label,
+            'perm': perm,
+            'users': len(user_pks),
+            'objects': len(object_pks),
+            'row_bytes': row_bytes,
+        }
+        section['users_offset'] = len(body)
+        for pk in user_pks:
+            body += _ID.pack(pk)
+        section['objects_offset'] = len(body)
+        for pk in object_pks:
+            body += _ID.pack(pk)
+        section['bits_offset'] = len(body)
+        for user_pk in user_pks:
+            row = bytearray(row_bytes)
+            for object_pk in allowed[user_pk]:
+                # Objects created during the audit are not in the snapshot
+                index = object_index.get(object_pk)
+                if index is not None:
+                    row[index // 8] |= 1 << (index % 8)
+            body += row
+        header_sections.append(section)
+
+    header = json.dumps({'created': time.time(), 'sections': header_sections}).encode('utf-8')
+    header += b' ' * (_align(len(header)) - len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.perm-snapshot-')
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            output.write(_PREFIX.pack(SNAPSHOT_MAGIC, len(header), 0))
+            output.write(header)
+            output.write(bytes(body))
+        os.chmod(temp_path, 0o644)
+        _replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return len(header_sections)
+
+
+class Snapshot(object):
+    """
+    Read only, memory mapped permission snapshot. The pages are shared by all processes that map the same file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            stat = os.fstat(snapshot_file.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime)
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length, padding = _PREFIX.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise PermException('{path} is not a permission snapshot.'.format(path=path))
+        start = _PREFIX.size
+        header = json.loads(self._mmap[start:start + header_length].decode('utf-8'))
+        self.created = header['created']
+        body_offset = start + header_length
+        self._sections = {}
+        for section in header['sections']:
+            self._sections[(section['model'], section['perm'])] = (
+                _IdArray(self._mmap, body_offset + section['users_offset'], section['users']),
+                _IdArray(self._mmap, body_offset + section['objects_offset'], section['objects']),
+                body_offset + section['bits_offset'],
+                section['row_bytes'],
+            )
+
+    def lookup(self, model_label, perm, user_pk, object_pk):
+        """
+        Return True or False if the snapshot knows the answer, None if it does not
+        """
+        try:
+            users, objects, bits_offset, row_bytes = self._sections[(model_label, perm)]
+        except KeyError:
+            return None
+        user_index = bisect_left(users, user_pk)
+        if user_index == len(users) or users[user_index] != user_pk:
+            return None
+        object_index = bisect_left(objects, object_pk)
+        if object_index == len(objects) or objects[object_index] != object_pk:
+            return None
+        byte = _BYTE.unpack_from(self._mmap, bits_offset + user_index * row_bytes + object_index // 8)[0]
+        return bool(byte & (1 << (object_index % 8)))
+
+
+class SnapshotReader(object):
+    """
+    Singleton object that keeps the snapshot in PERM_SETTINGS['snapshot'] mapped, and maps it again when the
+    file is replaced
+    """
+    _snapshot = None
+    _checked = 0
+    # Identity of a file that could not be read, it is not tried again until it is replaced
+    _broken = None
+    _lock = threading.Lock()
+
+    def _open(self, path, identity):
+        try:
+            return Snapshot(path)
+        except Exception:
+            # A broken snapshot is the same as no snapshot, permissions are checked live
+            logger.exception('Cannot read permission snapshot %s', path)
+            self._broken = identity
+            return None
+
+    def get_snapshot(self):
+        """
+        Return the current Snapshot, or None if there is none or it is too old
+        """
+        snapshot_settings = perm_settings['snapshot']
+        path = snapshot_settings['path']
+        if not path:
+            return None
+        now = time.time()
+        if now - self._checked >= snapshot_settings['check_interval']:
+            with self._lock:
+                self._checked = now
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    self._snapshot = None
+                else:
+                    identity = (stat.st_ino, stat.st_mtime)
+                    if identity == self._broken:
+                        self._snapshot = None
+                    elif self._snapshot is None or self._snapshot.identity != identity:
+                        self._snapshot = self._open(path, identity)
+        snapshot = self._snapshot
+        if snapshot is None or now - snapshot.created > snapshot_settings['max_age']:
+            return None
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._snapshot = None
+            self._checked = 0
+            self._broken = None
+
+    def lookup(self, model, perm, user_obj, obj):
+        """
+        Return the result for ``user_obj`` and ``obj`` from the snapshot, or None if it is not in the snapshot
+        """
+        if obj is None or user_obj is None:
+            return None
+        user_pk = getattr(user_obj, 'pk', None)
+        object_pk = getattr(obj, 'pk', None)
+        if not isinstance(user_pk, integer_types) or not isinstance(object_pk, integer_types):
+            return None
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return None
+        return snapshot.lookup(get_model_label(model), perm, user_pk, object_pk)
+
+
+# Instantiate the singleton
+snapshot_reader = SnapshotReader()
@@ -1,26 +1,51 @@
 from __future__ import unicode_literals
 
 from django.db.models import Model
+from django.db.models.query import QuerySet
 from django.template import Library, TemplateSyntaxError
 
+from ..permissions import permissions_manager
+from ..shortcuts import get_object_perms
 from ..utils import get_model_for_perm
 
 register = Library()
 
 
-@register.assignment_tag(takes_context=True)
-def perm(context, action, obj_or_model=None):
-    tag = 'perm'
-    if obj_or_model and not isinstance(obj_or_model, Model):
-        obj_or_model = get_model_for_perm(obj_or_model, raise_exception=True)
+def _get_user(context, tag):
     try:
         request = context['request']
     except KeyError:
-        raise TemplateSyntaxError("Tag '%(tag)' requires request context".format(tag=tag))
+        raise TemplateSyntaxError("Tag '{tag}' requires request context".format(tag=tag))
     try:
-        user = request.user
+        return request.user
     except AttributeError:
-        raise TemplateSyntaxError("Tag '%(tag)' requires attribute 'user' in request context".format(tag=tag))
+        raise TemplateSyntaxError("Tag '{tag}' requires attribute 'user' in request context".format(tag=tag))
+
+
+@register.assignment_tag(takes_context=True)
+def perm(context, action, obj_or_model=None):
+    tag = 'perm'
+    if obj_or_model and not isinstance(obj_or_model, Model):
+        obj_or_model = get_model_for_perm(obj_or_model, raise_exception=True)
+    user = _get_user(context, tag)
     if obj_or_model:
         return user.has_perm(action, obj_or_model)
     return user.has_perm(action)
+
+
+@register.assignment_tag(takes_context=True)
+def perms(context, obj):
+    """
+    Return a lazy proxy for all permissions on ``obj``, use as ``{% perms obj as p %}{{ p.change }}``
+    """
+    return get_object_perms(_get_user(context, 'perms'), obj)
+
+
+@register.assignment_tag
+def perm_prefetch(objects, *actions):
+    """
+    Load the related objects needed to check ``actions`` for each of ``objects``, before any of them is checked
+    """
+    if isinstance(objects, QuerySet):
+        return permissions_manager.prepare_queryset(objects, *actions)
+    return permissions_manager.prepare_objects(objects, *actions)
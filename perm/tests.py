@@ -1,16 +1,57 @@
 from __future__ import unicode_literals
 
-from unittest import TestCase
+try:
+    import asyncio
+except ImportError:
+    # Python 2
+    asyncio = None
+import gc
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import weakref
+from unittest import TestCase, skipUnless
 
-from django.contrib.auth.models import User
-from django.db import models
+from concurrent.futures import Executor, Future
+
+from django.contrib.admin import AdminSite, ModelAdmin
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.core.signals import request_finished
+from django.db import connection, connections, models, transaction
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.template import Template, Context
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.six import StringIO
 
+from .admin import PermModelAdminMixin
+from .audit import read_audit
+from .conf import merge_settings, perm_settings, PERM_DEFAULT_SETTINGS
+from .bulk import bulk_has_perm, get_perms_for_object
+from .debug import explain_perm, trace_perms
 from .decorators import permissions_for
-from .exceptions import PermAppException
-from .permissions import ModelPermissions
-from .utils import get_model_for_perm
+from .exceptions import PermAppException, PermException, PermTimeoutExceeded, PermCircuitOpen
+from .expressions import AllPerms, AnyPerm, Perm, get_perm_stats, perm_stats
+from .middleware import PermRequestScopeMiddleware
+from .refresh import refresh_ahead
+from .routing import use_primary
+from .scope import CompiledExists, get_request_scope, request_scope
+from . import audit, refresh, snapshot
+from .snapshot import build_snapshot, snapshot_reader
+from .rules import FieldIs, FieldIsUser, UserFieldIs, UserInField
+from .shortcuts import get_perm_queryset, iter_perm_queryset, perm_delete, perm_update, users_with_perm
+from .permissions import ModelPermissions, permissions_manager, TIMEOUT_CACHED, TIMEOUT_RAISE
+from .views import PermListView
+from .timeouts import (
+    circuit_breakers, evaluate_within_budget, get_circuit_breaker_states, get_last_known_expires, CIRCUIT_OPEN,
+)
+from .utils import get_model_for_perm, parse_perm
 
 # Dummy patterns to satisfy Django
 urlpatterns = ()
@@ -28,8 +69,45 @@ class Person(models.Model):
         return '{first_name} {last_name}'.format(first_name=self.first_name, last_name=self.last_name).strip()
 
 
+@python_2_unicode_compatible
+class Pet(models.Model):
+    name = models.CharField(max_length=30)
+    owner = models.ForeignKey(Person, on_delete=models.CASCADE)
+
+    def user_can_feed(self, user):
+        return self.owner.first_name == user.username
+
+    def __str__(self):
+        return self.name
+
+
+@python_2_unicode_compatible
+class Project(models.Model):
+    name = models.CharField(max_length=30)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='perm_owned_projects')
+    members = models.ManyToManyField(User, related_name='perm_projects')
+    is_public = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.name
+
+
+@python_2_unicode_compatible
+class Task(models.Model):
+    name = models.CharField(max_length=30)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.name
+
+
+SLOW_PERM_SECONDS = 0.1
+
+
 @permissions_for(Person)
 class PersonPermissions(ModelPermissions):
+    perm_user_attributes = {'create': ['is_superuser'], 'slow': ['is_staff']}
+
     def has_perm_create(self):
         # Only superuser can create
         return self.user.is_superuser
@@ -38,17 +116,69 @@ class PersonPermissions(ModelPermissions):
         # Let's ask the Person object
         return self.obj.user_can_visit(self.user)
 
+    def has_perm_slow(self):
+        # Simulate a slow call to another service
+        time.sleep(SLOW_PERM_SECONDS)
+        return self.user.is_staff
+
     def get_queryset_perm_gamma(self):
         # Permission gamma can only be tested by queryset and will not work on Model Class
         if self.user.username == 'gamma' or self.user.is_superuser:
             return self.model.objects.all()
         return self.model.objects.none()
 
+    def get_user_queryset_perm_gamma(self, users):
+        # The users that get_queryset_perm_gamma lets through
+        return users.filter(models.Q(username='gamma') | models.Q(is_superuser=True))
+
+
+@permissions_for(Pet)
+class PetPermissions(ModelPermissions):
+    perm_select_related = {'feed': ['owner']}
+
+    def has_perm_feed(self):
+        # Follows the foreign key to owner
+        return self.obj.user_can_feed(self.user)
+
+    def get_queryset_perm_list(self):
+        return self.model.objects.all()
+
+
+@permissions_for(Project)
+class ProjectPermissions(ModelPermissions):
+    rules = {
+        'view': FieldIs('is_public') | FieldIsUser('owner') | UserInField('members'),
+        'change': FieldIsUser('owner') | UserFieldIs('is_staff'),
+        'delete': FieldIsUser('owner') & ~FieldIs('is_public'),
+    }
+
+
+@permissions_for(Task)
+class TaskPermissions(ModelPermissions):
+    rules = {
+        'change': FieldIsUser('project__owner'),
+    }
+
 
 class MockRequest(object):
     pass
 
 
+class ReplicaRouter(object):
+    """
+    Send all reads to the replica
+    """
+
+    def db_for_read(self, model, **hints):
+        return 'replica'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
 def get_request_for_user(user):
     request = MockRequest()
     request.user = user
@@ -69,6 +199,30 @@ class UtilsTest(TestCase):
             get_model_for_perm('does.NotExist', raise_exception=True)
         self.assertEqual(None, get_model_for_perm('does.NotExist', raise_exception=False))
         self.assertEqual(Person, get_model_for_perm('perm.Person', raise_exception=False))
+        # Second time around the result is remembered
+        self.assertEqual(Person, get_model_for_perm('perm.Person', raise_exception=False))
+        self.assertEqual(None, get_model_for_perm('does.NotExist', raise_exception=False))
+
+    def test_parse_perm(self):
+        self.assertEqual(('perm', 'visit'), parse_perm('perm.visit'))
+        self.assertEqual((None, 'visit'), parse_perm('visit'))
+        # Second time around the same tuple is returned
+        self.assertIs(parse_perm('visit'), parse_perm('visit'))
+        with self.assertRaises(ValueError):
+            parse_perm('too.many.dots')
+
+    def test_merge_settings(self):
+        merged = merge_settings(PERM_DEFAULT_SETTINGS, {
+            'database': 'replica',
+            'refresh': {'mode': 'thread', 'hits': 10, 'ahead': 0.2},
+        })
+        self.assertEqual('replica', merged['database'])
+        self.assertEqual('thread', merged['refresh']['mode'])
+        # Keys that are not in a partial section keep their default
+        self.assertEqual(PERM_DEFAULT_SETTINGS['refresh']['max_keys'], merged['refresh']['max_keys'])
+        self.assertEqual(PERM_DEFAULT_SETTINGS['timeouts'], merged['timeouts'])
+        # The defaults are not changed
+        self.assertEqual(None, PERM_DEFAULT_SETTINGS['refresh']['mode'])
 
 
 class PermissionsTest(TestCase):
@@ -119,6 +273,14 @@ class PermissionsTest(TestCase):
         # Except without an object, then the result will be False
         self.assertEqual(False, self.normal_user.has_perm(perm))
 
+    def test_permission_app(self):
+        self.assertEqual(True, self.staff_user.has_perm('perm.visit', self.person))
+        with self.assertRaises(PermAppException):
+            self.staff_user.has_perm('auth.visit', self.person)
+        # Models without registered permissions are skipped before the permission is looked at
+        self.assertEqual(False, self.staff_user.has_perm('other.visit', self.staff_user))
+        self.assertEqual(False, self.staff_user.has_perm('visit', 'auth.User'))
+
     def test_template_tag_perm(self):
         # Inner function to test a template
         def _test_template(user, perm):
@@ -138,3 +300,1132 @@ class PermissionsTest(TestCase):
         self.staff_user.delete()
         self.normal_user.delete()
         self.person.delete()
+
+
+class BulkTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.persons = [Person.objects.create(first_name='bulk', last_name=str(i)) for i in range(8)]
+        self.staff_user = User.objects.create(username='bulk_staff', is_staff=True)
+        self.normal_user = User.objects.create(username='bulk_normal')
+
+    def test_bulk_sequential(self):
+        self.assertEqual([True] * 8, bulk_has_perm(self.staff_user, 'visit', self.persons))
+        self.assertEqual([False] * 8, bulk_has_perm(self.normal_user, 'visit', self.persons))
+
+    def test_bulk_ordered_with_queryset_perms(self):
+        objects = [self.persons[0], self.staff_user, self.persons[1]]
+        # Users have no registered permissions, persons use the queryset for gamma
+        self.assertEqual([False, False, False], bulk_has_perm(self.staff_user, 'gamma', objects, workers=4))
+
+    def test_bulk_queryset_perm_one_query(self):
+        super_user = User.objects.create(username='bulk_super', is_superuser=True)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual([True] * 8, bulk_has_perm(super_user, 'gamma', self.persons))
+        self.assertEqual(1, len(context.captured_queries))
+        self.assertEqual([False] * 8, bulk_has_perm(self.normal_user, 'gamma', self.persons))
+        super_user.delete()
+
+    def test_bulk_parallel_is_faster(self):
+        start = time.time()
+        results = bulk_has_perm(self.staff_user, 'slow', self.persons, workers=8)
+        elapsed = time.time() - start
+        self.assertEqual([True] * 8, results)
+        # Serial evaluation would take 8 * SLOW_PERM_SECONDS
+        self.assertLess(elapsed, 4 * SLOW_PERM_SECONDS)
+
+    def test_bulk_timeout(self):
+        results = bulk_has_perm(self.staff_user, 'slow', self.persons[:2], workers=2, timeout=SLOW_PERM_SECONDS / 10)
+        self.assertEqual([False, False], results)
+        results = bulk_has_perm(self.staff_user, 'slow', self.persons[2:4], workers=2, timeout=SLOW_PERM_SECONDS / 10,
+                                timeout_result=None)
+        self.assertEqual([None, None], results)
+
+    def tearDown(self):
+        # Give timed out checks the chance to finish before their objects are deleted
+        time.sleep(SLOW_PERM_SECONDS)
+        for person in self.persons:
+            person.delete()
+        self.staff_user.delete()
+        self.normal_user.delete()
+
+
+class TimeBudgetTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        circuit_breakers.reset()
+        self.person = Person.objects.create(first_name='budget', last_name='person')
+        self.staff_user = User.objects.create(username='budget_staff', is_staff=True)
+        PersonPermissions.perm_time_budgets = {'slow': SLOW_PERM_SECONDS / 5}
+
+    def _get_permissions(self):
+        return permissions_manager.get_permissions(Person, self.staff_user, 'slow', self.person)
+
+    def test_deny(self):
+        start = time.time()
+        self.assertEqual(False, self.staff_user.has_perm('slow', self.person))
+        self.assertLess(time.time() - start, SLOW_PERM_SECONDS)
+        # Other permissions are not affected
+        self.assertEqual(True, self.staff_user.has_perm('visit', self.person))
+
+    def test_raise(self):
+        PersonPermissions.time_budget_fallback = TIMEOUT_RAISE
+        with self.assertRaises(PermTimeoutExceeded):
+            self._get_permissions().has_perm()
+
+    def test_cached(self):
+        PersonPermissions.time_budget_fallback = TIMEOUT_CACHED
+        # Nothing known yet, so deny
+        self.assertEqual(False, self._get_permissions().has_perm())
+        # Evaluate once within a generous budget, then drop the regular cache entry
+        PersonPermissions.perm_time_budgets = {'slow': SLOW_PERM_SECONDS * 10}
+        self.assertEqual(True, self._get_permissions().has_perm())
+        caches['default'].delete(self._get_permissions().get_cache_key())
+        PersonPermissions.perm_time_budgets = {'slow': SLOW_PERM_SECONDS / 5}
+        self.assertEqual(True, self._get_permissions().has_perm())
+
+    def test_last_known_expires(self):
+        # Only kept for the cached fallback
+        PersonPermissions.perm_time_budgets = {'slow': SLOW_PERM_SECONDS * 10}
+        self.assertEqual(True, self._get_permissions().has_perm())
+        last_known_key = '{key}-LAST'.format(key=self._get_permissions().get_cache_key())
+        self.assertEqual(None, caches['default'].get(last_known_key))
+
+        self.assertEqual(600, get_last_known_expires())
+        cache_settings = perm_settings['cache']
+        try:
+            perm_settings['cache'] = dict(cache_settings, expires=None)
+            self.assertEqual(None, get_last_known_expires())
+        finally:
+            perm_settings['cache'] = cache_settings
+
+    def test_atomic_block(self):
+        # Evaluated inline without a budget, a pool thread cannot see the writes of the transaction
+        with transaction.atomic():
+            self.assertEqual(True, self._get_permissions().has_perm())
+
+    def test_circuit_breaker(self):
+        for i in range(3):
+            self.assertEqual(False, self._get_permissions().has_perm())
+        states = get_circuit_breaker_states()
+        self.assertEqual(CIRCUIT_OPEN, states['perm.tests.PersonPermissions:slow']['state'])
+        self.assertEqual(3, states['perm.tests.PersonPermissions:slow']['failures'])
+        # An open circuit skips evaluation
+        PersonPermissions.time_budget_fallback = TIMEOUT_RAISE
+        start = time.time()
+        with self.assertRaises(PermCircuitOpen):
+            self._get_permissions().has_perm()
+        self.assertLess(time.time() - start, SLOW_PERM_SECONDS / 5)
+
+    def test_circuit_breaker_error(self):
+        class FailingPermissions(object):
+            perm = 'fail'
+
+            def _has_perm(self):
+                raise ValueError('Service unavailable')
+
+        breaker = circuit_breakers.get(FailingPermissions, 'fail')
+        for i in range(3):
+            with self.assertRaises(ValueError):
+                evaluate_within_budget(FailingPermissions(), 1)
+        self.assertEqual(CIRCUIT_OPEN, breaker.get_state()['state'])
+        # The probe in half open state fails too, and opens the circuit again
+        breaker.opened_at -= breaker.cooldown
+        with self.assertRaises(ValueError):
+            evaluate_within_budget(FailingPermissions(), 1)
+        self.assertEqual(CIRCUIT_OPEN, breaker.get_state()['state'])
+        with self.assertRaises(PermCircuitOpen):
+            evaluate_within_budget(FailingPermissions(), 1)
+        # After the cooldown there is a new probe
+        breaker.opened_at -= breaker.cooldown
+        self.assertEqual(True, breaker.allow())
+
+    def tearDown(self):
+        PersonPermissions.perm_time_budgets = {}
+        PersonPermissions.time_budget_fallback = None
+        circuit_breakers.reset()
+        time.sleep(SLOW_PERM_SECONDS)
+        self.person.delete()
+        self.staff_user.delete()
+
+
+class PrefetchTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.owners = [Person.objects.create(first_name='owner', last_name=str(i)) for i in range(4)]
+        self.pets = [Pet.objects.create(name='pet{i}'.format(i=i), owner=owner) for i, owner in enumerate(self.owners)]
+        self.user = User.objects.create(username='owner')
+
+    def test_bulk_queryset(self):
+        with CaptureQueriesContext(connection) as context:
+            results = bulk_has_perm(self.user, 'feed', Pet.objects.filter(name__startswith='pet'))
+        self.assertEqual([True] * 4, results)
+        self.assertEqual(1, len(context.captured_queries))
+
+    def test_bulk_objects(self):
+        pets = list(Pet.objects.filter(name__startswith='pet'))
+        with CaptureQueriesContext(connection) as context:
+            results = bulk_has_perm(self.user, 'feed', pets)
+        self.assertEqual([True] * 4, results)
+        self.assertEqual(1, len(context.captured_queries))
+
+    def test_list_view(self):
+        view = PermListView(model=Pet, perm='list', prefetch_perms=('feed',))
+        view.request = get_request_for_user(self.user)
+        self.assertEqual({'owner': {}}, view.get_queryset().query.select_related)
+
+    def test_template_tag(self):
+        template = (
+            '{% perm_prefetch pets "feed" as pets %}'
+            '{% for pet in pets %}{% perm "feed" pet as var %}{{ var }}{% endfor %}'
+        )
+        pets = Pet.objects.filter(name__startswith='pet')
+        with CaptureQueriesContext(connection) as context:
+            result = render_template(template, request=get_request_for_user(self.user), pets=pets)
+        self.assertEqual('TrueTrueTrueTrue', result)
+        self.assertEqual(1, len(context.captured_queries))
+
+    def tearDown(self):
+        for owner in self.owners:
+            owner.delete()
+        self.user.delete()
+
+
+class PaginationTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.owner = Person.objects.create(first_name='page', last_name='owner')
+        self.pets = [Pet.objects.create(name='page{i}'.format(i=i), owner=self.owner) for i in range(5)]
+        self.user = User.objects.create(username='page_user')
+
+    def paginate(self, page, **kwargs):
+        queryset = Pet.objects.filter(name__startswith='page').order_by('pk')
+        view = PermListView(model=Pet, perm='list', queryset=queryset, **kwargs)
+        view.request = RequestFactory().get('/', {'page': page})
+        view.request.user = self.user
+        view.kwargs = {}
+        with CaptureQueriesContext(connection) as context:
+            paginator, page, object_list, is_paginated = view.paginate_queryset(view.get_queryset(), 2)
+            object_list = list(object_list)
+        counts = [query for query in context.captured_queries if 'COUNT(' in query['sql']]
+        return paginator, page, object_list, len(counts)
+
+    def test_cached_count(self):
+        paginator, page, object_list, counts = self.paginate(1)
+        self.assertEqual((5, 2, 1), (paginator.count, len(object_list), counts))
+        paginator, page, object_list, counts = self.paginate(3)
+        self.assertEqual((5, 1, 0), (paginator.count, len(object_list), counts))
+        # Saving a pet invalidates the count
+        self.pets.append(Pet.objects.create(name='page5', owner=self.owner))
+        paginator, page, object_list, counts = self.paginate(3)
+        self.assertEqual((6, 2, 1), (paginator.count, len(object_list), counts))
+        # So does an update through perm_update
+        perm_update(Pet.objects.filter(name='page5'), self.user, 'list', name='other')
+        paginator, page, object_list, counts = self.paginate(1)
+        self.assertEqual((5, 1), (paginator.count, counts))
+
+    def test_custom_paginator_class(self):
+        class CustomPaginator(Paginator):
+            pass
+
+        paginator, page, object_list, counts = self.paginate(1, paginator_class=CustomPaginator)
+        self.assertIsInstance(paginator, CustomPaginator)
+        self.assertEqual((5, 2), (paginator.count, len(object_list)))
+        # Without cached counts, the paginator of Django
+        counts_settings = perm_settings['counts']
+        try:
+            perm_settings['counts'] = {'expires': None}
+            paginator, page, object_list, counts = self.paginate(1)
+            self.assertIs(Paginator, paginator.__class__)
+        finally:
+            perm_settings['counts'] = counts_settings
+
+    def test_paginate_without_count(self):
+        paginator, page, object_list, counts = self.paginate(1, paginate_without_count=True)
+        self.assertEqual((2, True, 0), (len(object_list), page.has_next(), counts))
+        self.assertEqual((1, 2), (page.start_index(), page.end_index()))
+        # Only the pages known to exist
+        self.assertEqual([1, 2], list(paginator.page_range))
+        paginator, page, object_list, counts = self.paginate(3, paginate_without_count=True)
+        self.assertEqual((1, False, 5), (len(object_list), page.has_next(), page.end_index()))
+        self.assertEqual([1, 2, 3], list(paginator.page_range))
+        self.assertIsNone(paginator.count)
+
+    def tearDown(self):
+        for pet in Pet.objects.filter(owner=self.owner):
+            pet.delete()
+        self.owner.delete()
+        self.user.delete()
+
+
+class ObjectPermissionsTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.person = Person.objects.create(first_name='proxy', last_name='person')
+        self.superuser = User.objects.create(username='proxy_super', is_superuser=True)
+        self.normal_user = User.objects.create(username='gamma')
+
+    def test_perm_names(self):
+        self.assertEqual(['create', 'gamma', 'slow', 'visit'], PersonPermissions.get_perm_names())
+
+    def test_get_perms_for_object(self):
+        perms = get_perms_for_object(self.normal_user, self.person, ['create', 'gamma', 'visit'])
+        self.assertEqual({'create': False, 'gamma': True, 'visit': False}, perms)
+        # Now everything comes from the cache
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(perms, get_perms_for_object(self.normal_user, self.person, ['create', 'gamma', 'visit']))
+        self.assertEqual(0, len(context.captured_queries))
+
+    def test_template_tag_perms(self):
+        template = '{% perms person as p %}{{ p.gamma }} {{ p.visit }} {{ p.create }} {{ p.gamma }} {{ p.unknown }}'
+        with CaptureQueriesContext(connection) as context:
+            result = render_template(template, request=get_request_for_user(self.normal_user), person=self.person)
+        self.assertEqual('True False False True False', result)
+        # Only the gamma queryset needs a query, and only once
+        self.assertEqual(1, len(context.captured_queries))
+        result = render_template(template, request=get_request_for_user(self.superuser), person=self.person)
+        self.assertEqual('True True True True True', result)
+
+    def tearDown(self):
+        self.person.delete()
+        self.superuser.delete()
+        self.normal_user.delete()
+
+
+class RulesTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.owner = User.objects.create(username='rules_owner')
+        self.member = User.objects.create(username='rules_member')
+        self.staff_user = User.objects.create(username='rules_staff', is_staff=True)
+        self.private = Project.objects.create(name='private', owner=self.owner)
+        self.private.members.add(self.member)
+        self.public = Project.objects.create(name='public', owner=self.owner, is_public=True)
+        self.task = Task.objects.create(name='task', project=self.private)
+
+    def test_single_check_without_query(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(True, self.owner.has_perm('change', self.private))
+            self.assertEqual(True, self.staff_user.has_perm('change', self.private))
+            self.assertEqual(False, self.member.has_perm('change', self.private))
+            self.assertEqual(True, self.owner.has_perm('delete', self.private))
+            self.assertEqual(False, self.owner.has_perm('delete', self.public))
+            self.assertEqual(True, self.member.has_perm('view', self.public))
+        self.assertEqual(0, len(context.captured_queries))
+
+    def test_membership(self):
+        self.assertEqual(True, self.member.has_perm('view', self.private))
+        self.assertEqual(False, self.staff_user.has_perm('view', self.private))
+
+    def test_follow_foreign_key(self):
+        self.assertEqual(True, self.owner.has_perm('change', self.task))
+        self.assertEqual(False, self.member.has_perm('change', self.task))
+        self.assertEqual((['project'], []), TaskPermissions.get_related_paths('change'))
+
+    def test_queryset(self):
+        projects = Project.objects.filter(pk__in=[self.private.pk, self.public.pk])
+        self.assertEqual({self.private, self.public}, set(get_perm_queryset(Project, self.member, 'view') & projects))
+        self.assertEqual({self.public}, set(get_perm_queryset(Project, self.staff_user, 'view') & projects))
+        self.assertEqual({self.private, self.public}, set(get_perm_queryset(Project, self.staff_user, 'change')))
+        self.assertEqual({self.private}, set(get_perm_queryset(Project, self.owner, 'delete')))
+        self.assertEqual({self.task}, set(get_perm_queryset(Task, self.owner, 'change')))
+
+    def test_queryset_anonymous_and_inactive_user(self):
+        anonymous = AnonymousUser()
+        self.assertEqual(False, anonymous.has_perm('view', self.public))
+        self.assertEqual(set(), set(get_perm_queryset(Project, anonymous, 'view')))
+        inactive = User.objects.create(username='rules_inactive', is_active=False)
+        project = Project.objects.create(name='inactive', owner=inactive)
+        self.assertEqual(False, ProjectPermissions(Project, inactive, 'change', project).has_perm())
+        self.assertEqual(set(), set(get_perm_queryset(Project, inactive, 'change')))
+        project.delete()
+        inactive.delete()
+
+    def test_bulk_one_query(self):
+        projects = Project.objects.filter(pk__in=[self.private.pk, self.public.pk]).order_by('pk')
+        for user in (self.owner, self.member, self.staff_user):
+            expected = [user.has_perm('view', project) for project in projects]
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(expected, bulk_has_perm(user, 'view', projects))
+            self.assertEqual(1, len(context.captured_queries))
+
+    def tearDown(self):
+        self.private.delete()
+        self.public.delete()
+        self.owner.delete()
+        self.member.delete()
+        self.staff_user.delete()
+
+
+class ProjectAdmin(PermModelAdminMixin, ModelAdmin):
+    list_display = ('name', 'owner')
+
+
+class AdminTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.owner = User.objects.create(username='admin_owner')
+        self.member = User.objects.create(username='admin_member')
+        self.private = Project.objects.create(name='admin_private', owner=self.owner)
+        self.private.members.add(self.member)
+        self.other = Project.objects.create(name='admin_other', owner=self.member)
+        self.model_admin = ProjectAdmin(Project, AdminSite())
+
+    def get_request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return request
+
+    def get_changelist(self, request):
+        model_admin = self.model_admin
+        changelist_class = model_admin.get_changelist(request)
+        return changelist_class(
+            request, Project, model_admin.list_display, model_admin.list_display_links, model_admin.list_filter,
+            model_admin.date_hierarchy, model_admin.search_fields, model_admin.list_select_related,
+            model_admin.list_per_page, model_admin.list_max_show_all, model_admin.list_editable, model_admin,
+        )
+
+    def test_queryset(self):
+        projects = [self.private.pk, self.other.pk]
+        queryset = self.model_admin.get_queryset(self.get_request(self.owner)).filter(pk__in=projects)
+        self.assertEqual({self.private}, set(queryset))
+        queryset = self.model_admin.get_queryset(self.get_request(self.member)).filter(pk__in=projects)
+        self.assertEqual({self.private, self.other}, set(queryset))
+
+    def test_queryset_not_found(self):
+        request = self.get_request(self.owner)
+        # Person only has a queryset for gamma, Group is not registered
+        for model in (Person, Group):
+            model_admin = ProjectAdmin(model, AdminSite())
+            self.assertEqual([], list(model_admin.get_queryset(request)))
+
+    def test_object_permissions(self):
+        request = self.get_request(self.member)
+        self.assertEqual(True, self.model_admin.has_view_permission(request, self.private))
+        self.assertEqual(False, self.model_admin.has_change_permission(request, self.private))
+        self.assertEqual(True, self.model_admin.has_change_permission(request, self.other))
+        self.assertEqual(True, self.model_admin.has_delete_permission(request, self.other))
+        # Without an object, the Django model permissions or a permission on the model class apply
+        self.assertEqual(False, self.model_admin.has_change_permission(request))
+
+    def test_changelist_precomputes_row_perms(self):
+        request = self.get_request(self.member)
+        changelist = self.get_changelist(request)
+        self.assertEqual({self.private, self.other}, set(changelist.result_list))
+        with CaptureQueriesContext(connection) as context:
+            for project in changelist.result_list:
+                self.assertEqual(project == self.other, self.model_admin.has_change_permission(request, project))
+                self.assertEqual(project == self.other, self.model_admin.has_delete_permission(request, project))
+                self.assertEqual(True, self.model_admin.has_view_permission(request, project))
+        self.assertEqual(0, len(context.captured_queries))
+
+    def tearDown(self):
+        self.private.delete()
+        self.other.delete()
+        self.owner.delete()
+        self.member.delete()
+
+
+class PermWriteTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.owner = User.objects.create(username='write_owner')
+        self.other = User.objects.create(username='write_other')
+        self.projects = [
+            Project.objects.create(name='write_{i}'.format(i=i), owner=self.owner if i % 2 else self.other,
+                                   is_public=i == 3)
+            for i in range(6)
+        ]
+        self.persons = [Person.objects.create(first_name='write', last_name=str(i)) for i in range(3)]
+        self.gamma_user = User.objects.create(username='gamma')
+        self.staff_user = User.objects.create(username='write_staff', is_staff=True)
+
+    def test_update_rule(self):
+        projects = Project.objects.filter(name__startswith='write_')
+        with CaptureQueriesContext(connection) as context:
+            result = perm_update(projects, self.owner, 'change', name='write_changed')
+        # A count and the UPDATE, with the rule in its WHERE clause
+        statements = [query['sql'] for query in context.captured_queries if query['sql'] != 'BEGIN']
+        self.assertEqual(2, len(statements))
+        self.assertTrue(statements[1].startswith('UPDATE'))
+        self.assertIn('owner_id', statements[1])
+        self.assertEqual((3, 3), result)
+        self.assertEqual(3, Project.objects.filter(name='write_changed', owner=self.owner).count())
+        self.assertEqual(0, Project.objects.filter(name='write_changed', owner=self.other).count())
+
+    def test_update_queryset_perm(self):
+        persons = Person.objects.filter(first_name='write')
+        self.assertEqual((0, 3), perm_update(persons, self.staff_user, 'gamma', last_name='changed'))
+        self.assertEqual((3, 0), perm_update(persons, self.gamma_user, 'gamma', last_name='changed'))
+        self.assertEqual(3, Person.objects.filter(first_name='write', last_name='changed').count())
+
+    def test_update_method_perm(self):
+        persons = Person.objects.filter(first_name='write')
+        self.assertEqual((0, 3), perm_update(persons, self.gamma_user, 'visit', last_name='visited'))
+        self.assertEqual((3, 0), perm_update(persons, self.staff_user, 'visit', chunk_size=2, last_name='visited'))
+        self.assertEqual(3, Person.objects.filter(first_name='write', last_name='visited').count())
+
+    def test_delete(self):
+        projects = Project.objects.filter(name__startswith='write_')
+        # The owner may delete own projects that are not public
+        self.assertEqual((2, 4), perm_delete(projects, self.owner))
+        self.assertEqual(4, projects.count())
+        self.assertEqual((0, 4), perm_delete(projects, AnonymousUser()))
+
+    def tearDown(self):
+        Project.objects.filter(name__startswith='write_').delete()
+        for person in self.persons:
+            person.delete()
+        for user in (self.owner, self.other, self.gamma_user, self.staff_user):
+            user.delete()
+
+
+class RoutingTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.person = Person.objects.create(first_name='routing', last_name='person')
+        self.normal_user = User.objects.create(username='gamma')
+        self.owner = User.objects.create(username='routing_owner')
+        self.project = Project.objects.create(name='routing', owner=self.owner)
+        self.project.members.add(self.normal_user)
+        PersonPermissions.database = 'replica'
+        ProjectPermissions.database = 'replica'
+
+    def _count_queries(self, func):
+        with CaptureQueriesContext(connections['default']) as default:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                func()
+        return len(default.captured_queries), len(replica.captured_queries)
+
+    def test_has_perm_using_queryset(self):
+        self.assertEqual((0, 1), self._count_queries(lambda: self.normal_user.has_perm('gamma', self.person)))
+
+    def test_has_perm_using_rule(self):
+        self.assertEqual((0, 1), self._count_queries(lambda: self.normal_user.has_perm('view', self.project)))
+
+    def test_get_perm_queryset(self):
+        queryset = get_perm_queryset(Project, self.normal_user, 'view')
+        self.assertEqual('replica', queryset.db)
+        self.assertEqual((0, 1), self._count_queries(lambda: list(queryset)))
+
+    def test_list_view(self):
+        view = PermListView(model=Project, perm='view')
+        view.request = get_request_for_user(self.normal_user)
+        queryset = view.get_queryset()
+        self.assertEqual([self.project], list(queryset))
+        self.assertEqual('default', queryset.db)
+
+    def test_use_primary(self):
+        with use_primary():
+            self.assertEqual((1, 0), self._count_queries(lambda: self.normal_user.has_perm('gamma', self.person)))
+            self.assertEqual('default', get_perm_queryset(Project, self.normal_user, 'view').db)
+
+    def test_use_primary_skips_cache(self):
+        PersonPermissions.database = None
+        ProjectPermissions.database = None
+        self.assertEqual(True, self.normal_user.has_perm('view', self.project))
+        self.project.members.remove(self.normal_user)
+        # The cached result is still there, use_primary() evaluates again and caches the fresh result
+        self.assertEqual(True, self.normal_user.has_perm('view', self.project))
+        with use_primary():
+            self.assertEqual(False, self.normal_user.has_perm('view', self.project))
+            self.assertEqual([False], bulk_has_perm(self.normal_user, 'view', [self.project]))
+        self.assertEqual(False, self.normal_user.has_perm('view', self.project))
+
+    def test_use_primary_with_router(self):
+        # No database for permission queries, the router sends reads to the replica
+        PersonPermissions.database = None
+        ProjectPermissions.database = None
+        with override_settings(DATABASE_ROUTERS=[ReplicaRouter()]):
+            self.assertEqual((0, 1), self._count_queries(lambda: self.normal_user.has_perm('view', self.project)))
+            caches['default'].clear()
+            with use_primary():
+                self.assertEqual((1, 0), self._count_queries(lambda: self.normal_user.has_perm('view', self.project)))
+                self.assertEqual((1, 0), self._count_queries(lambda: self.normal_user.has_perm('gamma', self.person)))
+                self.assertEqual('default', get_perm_queryset(Project, self.normal_user, 'view').db)
+
+    def tearDown(self):
+        PersonPermissions.database = None
+        ProjectPermissions.database = None
+        self.project.delete()
+        self.person.delete()
+        self.owner.delete()
+        self.normal_user.delete()
+
+
+class IterPermQuerySetTest(TestCase):
+    def setUp(self):
+        self.persons = [Person.objects.create(first_name='iter', last_name=str(i)) for i in range(5)]
+        self.normal_user = User.objects.create(username='gamma')
+        self.staff_user = User.objects.create(username='iter_staff', is_staff=True)
+
+    def test_iter_objects(self):
+        expected = list(Person.objects.order_by('pk'))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(expected, list(iter_perm_queryset(Person, self.normal_user, 'gamma', chunk_size=2)))
+        # Chunks of 2, 2 and 1
+        self.assertEqual(3, len(context.captured_queries))
+        self.assertNotIn('OFFSET', context.captured_queries[-1]['sql'])
+        self.assertEqual([], list(iter_perm_queryset(Person, self.staff_user, 'gamma', chunk_size=2)))
+
+    def test_iter_pks_and_values(self):
+        expected = list(Person.objects.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(expected, list(iter_perm_queryset(Person, self.normal_user, 'gamma', chunk_size=3,
+                                                           pks_only=True)))
+        rows = list(iter_perm_queryset(Person, self.normal_user, 'gamma', chunk_size=3, values=['last_name']))
+        self.assertEqual(expected, [row['pk'] for row in rows])
+        self.assertIn({'pk': self.persons[0].pk, 'last_name': '0'}, rows)
+
+    def tearDown(self):
+        for person in self.persons:
+            person.delete()
+        self.normal_user.delete()
+        self.staff_user.delete()
+
+
+class UsersWithPermTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.person = Person.objects.create(first_name='uwp', last_name='person')
+        self.owner = User.objects.create(username='uwp_owner')
+        self.member = User.objects.create(username='uwp_member')
+        self.staff_user = User.objects.create(username='uwp_staff', is_staff=True)
+        self.inactive_user = User.objects.create(username='uwp_inactive', is_staff=True, is_active=False)
+        self.gamma_user = User.objects.create(username='gamma')
+        self.project = Project.objects.create(name='uwp', owner=self.owner)
+        self.project.members.add(self.member, self.inactive_user)
+        self.users = User.objects.filter(pk__in=[
+            self.owner.pk, self.member.pk, self.staff_user.pk, self.inactive_user.pk, self.gamma_user.pk
+        ])
+
+    def test_rule(self):
+        with CaptureQueriesContext(connection) as context:
+            users = list(users_with_perm(self.project, 'view', self.users))
+        self.assertEqual({self.owner, self.member}, set(users))
+        self.assertEqual(1, len(context.captured_queries))
+        self.assertEqual({self.owner, self.staff_user}, set(users_with_perm(self.project, 'change', self.users)))
+        self.assertEqual({self.owner}, set(users_with_perm(self.project, 'delete', self.users)))
+
+    def test_user_queryset_method(self):
+        with CaptureQueriesContext(connection) as context:
+            users = list(users_with_perm(self.person, 'gamma', self.users))
+        self.assertEqual([self.gamma_user], users)
+        self.assertEqual(1, len(context.captured_queries))
+
+    def test_chunked_fallback(self):
+        users = list(users_with_perm(self.person, 'visit', self.users, chunk_size=2))
+        self.assertEqual([self.staff_user], users)
+        # Results are cached like any other check
+        self.assertEqual(True, self.staff_user.has_perm('visit', self.person))
+
+    def tearDown(self):
+        self.project.delete()
+        self.person.delete()
+        for user in self.users:
+            user.delete()
+
+
+class AuditTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.owner = User.objects.create(username='audit_owner')
+        self.member = User.objects.create(username='audit_member')
+        self.project = Project.objects.create(name='audit', owner=self.owner)
+        self.user_args = ['--user={pk}'.format(pk=self.owner.pk), '--user={pk}'.format(pk=self.member.pk)]
+
+    def _audit(self, name, *args):
+        path = os.path.join(self.directory, name)
+        call_command('perm_audit', '--model=perm.Project', '--output={path}'.format(path=path),
+                     *(self.user_args + list(args)), stdout=StringIO())
+        return path
+
+    def test_audit(self):
+        matrix = read_audit(self._audit('audit.gz', '--processes=1'))
+        project_pk = '{pk}'.format(pk=self.project.pk)
+        owner_pk = '{pk}'.format(pk=self.owner.pk)
+        member_pk = '{pk}'.format(pk=self.member.pk)
+        self.assertIn(project_pk, matrix[('perm.Project', 'change', owner_pk)])
+        self.assertNotIn(project_pk, matrix[('perm.Project', 'change', member_pk)])
+        self.assertEqual(6, len(matrix))
+
+    # Python 2 has no get_start_method(), and always forks on POSIX
+    @skipUnless(getattr(multiprocessing, 'get_start_method', lambda: 'fork')() == 'fork',
+                'Workers need a copy of the in-memory test database')
+    def test_audit_in_processes(self):
+        one = read_audit(self._audit('one.gz', '--processes=1'))
+        two = read_audit(self._audit('two.gz', '--processes=2', '--chunk-size=1'))
+        self.assertEqual(one, two)
+
+    def test_diff(self):
+        old = self._audit('old.gz', '--processes=1', '--perm=view')
+        self.project.members.add(self.member)
+        new = self._audit('new.gz', '--processes=1', '--perm=view')
+        output = StringIO()
+        call_command('perm_audit', '--diff', old, new, stdout=output)
+        self.assertEqual(
+            '+ perm.Project view user={user} object={object}\n1 changes.\n'.format(
+                user=self.member.pk, object=self.project.pk,
+            ),
+            output.getvalue()
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        self.project.delete()
+        self.owner.delete()
+        self.member.delete()
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        snapshot_reader.reset()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'perm.snapshot')
+        self.owner = User.objects.create(username='snapshot_owner')
+        self.member = User.objects.create(username='snapshot_member')
+        self.project = Project.objects.create(name='snapshot', owner=self.owner)
+        self.snapshot_settings = perm_settings['snapshot']
+        perm_settings['snapshot'] = {'path': self.path, 'max_age': 60, 'check_interval': 0}
+
+    def _build(self):
+        call_command('perm_snapshot', '--model=perm.Project', '--perm=view', '--processes=1',
+                     '--user={pk}'.format(pk=self.owner.pk), '--user={pk}'.format(pk=self.member.pk),
+                     '--output={path}'.format(path=self.path), stdout=StringIO())
+
+    def test_snapshot(self):
+        self._build()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(True, self.owner.has_perm('view', self.project))
+            self.assertEqual(False, self.member.has_perm('view', self.project))
+        self.assertEqual(0, len(context.captured_queries))
+        # The snapshot answers, even though the database has changed
+        self.project.members.add(self.member)
+        self.assertEqual(False, self.member.has_perm('view', self.project))
+        # Objects that are not in the snapshot are checked live
+        other = Project.objects.create(name='snapshot other', owner=self.member)
+        self.assertEqual(True, self.member.has_perm('view', other))
+        other.delete()
+
+    def test_swap(self):
+        self._build()
+        self.assertEqual(False, self.member.has_perm('view', self.project))
+        self.project.members.add(self.member)
+        self._build()
+        self.assertEqual(True, self.member.has_perm('view', self.project))
+
+    def test_stale(self):
+        self._build()
+        self.project.members.add(self.member)
+        perm_settings['snapshot']['max_age'] = 0
+        self.assertEqual(True, self.member.has_perm('view', self.project))
+
+    def test_object_created_during_build(self):
+        created = []
+
+        def compute_audit(units, processes=None):
+            created.append(Project.objects.create(name='snapshot new', owner=self.member))
+            return original(units, processes)
+
+        original = audit.compute_audit
+        audit.compute_audit = compute_audit
+        try:
+            self._build()
+        finally:
+            audit.compute_audit = original
+        # Not in the snapshot, so checked live
+        self.assertEqual(None, snapshot_reader.lookup(Project, 'view', self.member, created[0]))
+        self.assertEqual(True, self.member.has_perm('view', created[0]))
+        created[0].delete()
+
+    def test_broken(self):
+        with open(self.path, 'wb') as snapshot_file:
+            snapshot_file.write(b'not a snapshot')
+        logged = []
+
+        class Logger(object):
+            def exception(self, message, *args):
+                logged.append(message % args)
+
+        logger = snapshot.logger
+        snapshot.logger = Logger()
+        try:
+            self.assertEqual(None, snapshot_reader.get_snapshot())
+        finally:
+            snapshot.logger = logger
+        self.assertEqual(['Cannot read permission snapshot {path}'.format(path=self.path)], logged)
+        # Checked live, and the broken file is not read again
+        self.assertEqual(True, self.owner.has_perm('view', self.project))
+        self.assertEqual(None, snapshot_reader.get_snapshot())
+        # A good snapshot replaces it
+        self._build()
+        self.assertNotEqual(None, snapshot_reader.get_snapshot())
+
+    def test_non_integer_pk(self):
+        # Sessions have a string primary key
+        with self.assertRaises(PermException):
+            build_snapshot([('sessions.Session', 'view', (self.owner.pk,), 100)], self.path, processes=1)
+        self.assertEqual(False, os.path.exists(self.path))
+
+    def tearDown(self):
+        perm_settings['snapshot'] = self.snapshot_settings
+        snapshot_reader.reset()
+        shutil.rmtree(self.directory)
+        self.project.delete()
+        self.owner.delete()
+        self.member.delete()
+
+
+class ExplainTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.person = Person.objects.create(first_name='explain', last_name='person')
+        self.superuser = User.objects.create(username='explain_super', is_superuser=True)
+        self.normal_user = User.objects.create(username='gamma')
+
+    def test_explain_queryset(self):
+        explanation = explain_perm(self.normal_user, 'gamma', self.person)
+        self.assertEqual(True, explanation['result'])
+        self.assertEqual(True, explanation['backend_called'])
+        self.assertEqual('instance', explanation['model_resolved_from'])
+        self.assertEqual('perm.Person', explanation['model'])
+        self.assertEqual('perm.tests.PersonPermissions', explanation['permissions_class'])
+        self.assertEqual('queryset', explanation['path'])
+        self.assertEqual(False, explanation['cache_hit'])
+        self.assertTrue(explanation['cache_key'].startswith('PERM-'))
+        self.assertEqual(1, len(explanation['queries']))
+        self.assertIn('sql', explanation['queries'][0])
+        self.assertIsNotNone(explanation['duration'])
+        # Second time around, the result comes from the cache
+        explanation = explain_perm(self.normal_user, 'gamma', self.person)
+        self.assertEqual(True, explanation['cache_hit'])
+        self.assertEqual([], explanation['queries'])
+
+    def test_explain_method_and_string(self):
+        explanation = explain_perm(self.normal_user, 'create', 'perm.Person')
+        self.assertEqual(False, explanation['result'])
+        self.assertEqual('string', explanation['model_resolved_from'])
+        self.assertEqual('method', explanation['path'])
+
+    def test_explain_superuser(self):
+        explanation = explain_perm(self.superuser, 'gamma', self.person)
+        self.assertEqual(True, explanation['result'])
+        self.assertEqual(False, explanation['backend_called'])
+
+    def test_trace_perms(self):
+        with trace_perms() as traces:
+            self.normal_user.has_perm('visit', self.person)
+            self.normal_user.has_perm('create', Person)
+        self.assertEqual(2, len(traces))
+        self.assertEqual('class', traces[1]['model_resolved_from'])
+
+    def tearDown(self):
+        self.person.delete()
+        self.superuser.delete()
+        self.normal_user.delete()
+
+
+class ExpressionTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        perm_stats.reset()
+        self.persons = [Person.objects.create(first_name='expression', last_name=str(i)) for i in range(3)]
+        self.staff_user = User.objects.create(username='expression_staff', is_staff=True)
+
+    def test_operators(self):
+        person = self.persons[0]
+        self.assertEqual(True, self.staff_user.has_perm(Perm('create') | Perm('slow'), person))
+        self.assertEqual(False, self.staff_user.has_perm(Perm('create') & Perm('slow'), person))
+        self.assertEqual(True, self.staff_user.has_perm(Perm('slow') & ~Perm('create'), person))
+        self.assertEqual(True, AnyPerm('create', 'perm.slow').has_perm(self.staff_user, person))
+        self.assertEqual(False, AllPerms('slow', 'create').has_perm(self.staff_user, Person))
+        self.assertEqual('any(create,slow)', str(Perm('create') | Perm('slow')))
+
+    def test_cheap_decisive_check_goes_first(self):
+        expression = AllPerms('slow', 'create')
+        # The first evaluation follows the given order and measures both permissions
+        self.assertEqual(False, expression.has_perm(self.staff_user, self.persons[0]))
+        start = time.time()
+        self.assertEqual(False, expression.has_perm(self.staff_user, self.persons[1]))
+        self.assertLess(time.time() - start, SLOW_PERM_SECONDS / 2)
+        stats = get_perm_stats()
+        self.assertEqual(1, stats['perm.tests.PersonPermissions:slow']['count'])
+        self.assertEqual(2, stats['perm.tests.PersonPermissions:create']['count'])
+        self.assertEqual(0.0, stats['perm.tests.PersonPermissions:all(slow,create)']['true_rate'])
+
+    def test_unknown_check_is_measured(self):
+        expression = AnyPerm('slow', 'create')
+        self.assertEqual(True, expression.has_perm(self.staff_user, self.persons[0]))
+        self.assertNotIn('perm.tests.PersonPermissions:create', get_perm_stats())
+        # Now create has not been measured yet, so it goes first
+        self.assertEqual(True, expression.has_perm(self.staff_user, self.persons[1]))
+        self.assertIn('perm.tests.PersonPermissions:create', get_perm_stats())
+
+    def tearDown(self):
+        for person in self.persons:
+            person.delete()
+        self.staff_user.delete()
+
+
+class InlineExecutor(Executor):
+    """
+    Executor that runs in the calling thread, so that the test can count the queries
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+@skipUnless(sys.version_info >= (3, 5), 'asyncio with async/await')
+class LoaderTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.persons = [Person.objects.create(first_name='loader', last_name=str(i)) for i in range(6)]
+        self.superuser = User.objects.create(username='loader_super', is_superuser=True)
+        self.normal_user = User.objects.create(username='loader_normal')
+
+    def run_checks(self, checks):
+        from .loaders import PermLoader
+        loop = asyncio.new_event_loop()
+        try:
+            loader = PermLoader(loop, InlineExecutor())
+            futures = [loader.load(user, perm, obj) for user, perm, obj in checks]
+            return loop.run_until_complete(asyncio.gather(*futures))
+        finally:
+            loop.close()
+
+    def test_one_query_per_tick(self):
+        checks = [(self.superuser, 'gamma', person) for person in self.persons]
+        checks += [(self.superuser, 'gamma', self.persons[0]), (self.normal_user, 'create', self.persons[0])]
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual([True] * 7 + [False], self.run_checks(checks))
+        self.assertEqual(1, len(context.captured_queries))
+        # The results are cached now
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual([True] * 7 + [False], self.run_checks(checks))
+        self.assertEqual(0, len(context.captured_queries))
+
+    def test_no_queries_in_load(self):
+        from .loaders import PermLoader
+        # The cache key of a role with groups needs a query
+        attributes = PersonPermissions.perm_user_attributes
+        PersonPermissions.perm_user_attributes = dict(attributes, gamma=['groups'])
+        loop = asyncio.new_event_loop()
+        try:
+            loader = PermLoader(loop, InlineExecutor())
+            with CaptureQueriesContext(connection) as context:
+                futures = [loader.load(self.normal_user, 'gamma', person) for person in self.persons]
+                futures.append(loader.load(self.normal_user, 'gamma', self.persons[0]))
+            self.assertEqual(0, len(context.captured_queries))
+            self.assertEqual([False] * 7, loop.run_until_complete(asyncio.gather(*futures)))
+        finally:
+            loop.close()
+            PersonPermissions.perm_user_attributes = attributes
+
+    def test_loop_not_kept(self):
+        from .loaders import get_perm_loader
+        loop = asyncio.new_event_loop()
+        get_perm_loader(loop)
+        loop.close()
+        loop_ref = weakref.ref(loop)
+        del loop
+        gc.collect()
+        self.assertEqual(None, loop_ref())
+
+    def test_has_perm_async(self):
+        from .loaders import has_perm_async
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            checks = [has_perm_async(self.normal_user, 'gamma', person) for person in self.persons]
+            checks.append(has_perm_async(self.normal_user, 'gamma', self.normal_user))
+            self.assertEqual([False] * 7, loop.run_until_complete(asyncio.gather(*checks)))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def tearDown(self):
+        for person in self.persons:
+            person.delete()
+        self.superuser.delete()
+        self.normal_user.delete()
+
+
+class RoleTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.person = Person.objects.create(first_name='role', last_name='person')
+        self.staff_users = [User.objects.create(username='role_staff_{i}'.format(i=i), is_staff=True) for i in range(2)]
+        self.normal_user = User.objects.create(username='role_normal')
+        self.group = Group.objects.create(name='editors')
+        for user in self.staff_users:
+            user.groups.add(self.group)
+
+    def test_shared_result(self):
+        self.assertEqual(True, self.staff_users[0].has_perm('slow', self.person))
+        start = time.time()
+        self.assertEqual(True, self.staff_users[1].has_perm('slow', self.person))
+        self.assertLess(time.time() - start, SLOW_PERM_SECONDS / 2)
+        self.assertEqual(False, self.normal_user.has_perm('slow', self.person))
+
+    def test_groups(self):
+        class GroupPermissions(PersonPermissions):
+            perm_user_attributes = {'create': ['groups']}
+
+        keys = [GroupPermissions(Person, user, 'create', self.person).get_cache_key()
+                for user in self.staff_users + [self.normal_user]]
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+        # The groups are remembered on the user
+        with CaptureQueriesContext(connection) as context:
+            GroupPermissions(Person, self.staff_users[0], 'create', self.person).get_cache_key()
+        self.assertEqual(0, len(context.captured_queries))
+
+    def test_active_state_is_part_of_role(self):
+        inactive = User.objects.create(username='role_inactive', is_staff=True, is_active=False)
+        self.assertEqual(True, self.staff_users[0].has_perm('slow', self.person))
+        self.assertEqual(False, PersonPermissions(Person, inactive, 'slow', self.person).has_perm())
+        self.assertEqual(False, PersonPermissions(Person, None, 'slow', self.person).has_perm())
+        inactive.delete()
+
+    def tearDown(self):
+        self.person.delete()
+        for user in self.staff_users:
+            user.delete()
+        self.normal_user.delete()
+        self.group.delete()
+
+
+class RequestScopeTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.persons = [Person.objects.create(first_name='scope', last_name=str(i)) for i in range(3)]
+        self.gamma_user = User.objects.create(username='gamma')
+        self.normal_user = User.objects.create(username='scope_normal')
+
+    def test_queryset_built_once(self):
+        with request_scope():
+            queryset = get_perm_queryset(Person, self.gamma_user, 'gamma')
+            list(queryset)
+            self.assertEqual(1, len(get_request_scope()))
+            # A fresh clone, with the same query
+            again = get_perm_queryset(Person, self.gamma_user, 'gamma')
+            self.assertIsNot(queryset, again)
+            self.assertIsNone(again._result_cache)
+            self.assertEqual(str(queryset.query), str(again.query))
+        self.assertIsNone(get_request_scope())
+
+    def test_compiled_exists(self):
+        with request_scope():
+            for person in self.persons:
+                self.assertEqual(True, self.gamma_user.has_perm('gamma', person))
+                self.assertEqual(False, self.normal_user.has_perm('gamma', person))
+            compiled = [value for value in get_request_scope().values() if isinstance(value, CompiledExists)]
+            self.assertEqual(1, len(compiled))
+            self.assertEqual(False, compiled[0](max(person.pk for person in self.persons) + 1))
+
+    def test_compile(self):
+        queryset = Person.objects.filter(first_name='scope')
+        compiled = CompiledExists.compile(queryset, self.persons[0].pk)
+        self.assertEqual(True, compiled(self.persons[2].pk))
+        self.assertEqual(False, compiled(self.persons[2].pk + 1))
+        self.assertEqual(False, CompiledExists.compile(Person.objects.none(), self.persons[0].pk)(self.persons[0].pk))
+        self.assertIsNone(CompiledExists.compile(queryset, 'not an integer'))
+
+    def test_middleware(self):
+        middleware = PermRequestScopeMiddleware(lambda request: get_request_scope())
+        self.assertEqual({}, middleware(RequestFactory().get('/')))
+        self.assertIsNone(get_request_scope())
+
+    def tearDown(self):
+        for person in self.persons:
+            person.delete()
+        self.gamma_user.delete()
+        self.normal_user.delete()
+
+
+class RefreshAheadTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        refresh_ahead.reset()
+        self.refresh_settings = perm_settings['refresh']
+        perm_settings['refresh'] = dict(self.refresh_settings, mode='thread', hits=2, ahead=1.0)
+        self.person = Person.objects.create(first_name='refresh', last_name='person')
+        self.staff_user = User.objects.create(username='refresh_staff', is_staff=True)
+
+    def make_hot(self):
+        """
+        Check twice after the first check, with a wrong value in the cache to find out if it is refreshed
+        """
+        permissions = PersonPermissions(Person, self.staff_user, 'visit', self.person)
+        self.assertEqual(True, permissions.has_perm())
+        key = permissions.get_cache_key()
+        caches['default'].set(key, False)
+        self.assertEqual(False, permissions.has_perm())
+        return permissions, key
+
+    def test_refresh_in_thread(self):
+        permissions, key = self.make_hot()
+        self.assertEqual(False, permissions.has_perm())
+        for i in range(100):
+            if caches['default'].get(key):
+                break
+            time.sleep(0.01)
+        self.assertEqual(True, permissions.has_perm())
+
+    def test_refresh_after_response(self):
+        perm_settings['refresh']['mode'] = 'response'
+        permissions, key = self.make_hot()
+        self.assertEqual(False, permissions.has_perm())
+        self.assertEqual(False, caches['default'].get(key))
+        request_finished.send(sender=None)
+        self.assertEqual(True, caches['default'].get(key))
+
+    def test_cold_key_not_refreshed(self):
+        perm_settings['refresh']['mode'] = 'response'
+        perm_settings['refresh']['ahead'] = 0.2
+        permissions, key = self.make_hot()
+        # Hot, but far from expiry
+        self.assertEqual(False, permissions.has_perm())
+        request_finished.send(sender=None)
+        self.assertEqual(False, caches['default'].get(key))
+
+    def test_refresh_error(self):
+        class FailingPermissions(object):
+            def _evaluate(self, key):
+                raise ValueError('Database unavailable')
+
+        logged = []
+
+        class Logger(object):
+            def exception(self, message, *args):
+                logged.append(message % args)
+
+        logger = refresh.logger
+        refresh.logger = Logger()
+        try:
+            # After the response, the error does not reach the server
+            perm_settings['refresh']['mode'] = 'response'
+            refresh_ahead.schedule('refresh-error-response', FailingPermissions())
+            request_finished.send(sender=None)
+            # In a thread, the error is not lost
+            perm_settings['refresh']['mode'] = 'thread'
+            refresh_ahead.schedule('refresh-error-thread', FailingPermissions())
+            for i in range(100):
+                if len(logged) == 2:
+                    break
+                time.sleep(0.01)
+        finally:
+            refresh.logger = logger
+        self.assertEqual([
+            'Cannot refresh permission cache key refresh-error-response',
+            'Cannot refresh permission cache key refresh-error-thread',
+        ], logged)
+
+    def tearDown(self):
+        perm_settings['refresh'] = self.refresh_settings
+        refresh_ahead.reset()
+        self.person.delete()
+        self.staff_user.delete()
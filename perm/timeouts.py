@@ -0,0 +1,171 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from django.db import connections
+from django.utils.translation import ugettext_lazy as _
+
+from .conf import perm_settings
+from .exceptions import PermTimeoutExceeded, PermCircuitOpen
+from .utils import call_in_worker
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half-open'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Get the shared pool of threads that run time bounded checks
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=perm_settings['timeouts']['workers'])
+        return _executor
+
+
+class CircuitBreaker(object):
+    """
+    Keep track of a permission that is repeatedly too slow, and skip it for a while when it is
+    """
+
+    def __init__(self, name, threshold, cooldown):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.state = CIRCUIT_CLOSED
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return True if the permission may be evaluated
+        """
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_OPEN and time.time() >= self.opened_at + self.cooldown:
+                # Let one check through to see if the permission has recovered
+                self.state = CIRCUIT_HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.state = CIRCUIT_CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.threshold:
+                self.opened_at = time.time()
+                self.state = CIRCUIT_OPEN
+
+    def get_state(self):
+        """
+        Return the state of this breaker as a dict, for monitoring
+        """
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'opened_at': self.opened_at,
+                'retry_at': self.opened_at + self.cooldown if self.opened_at is not None else None,
+            }
+
+
+class CircuitBreakerRegistry(object):
+    """
+    Singleton object to hold a CircuitBreaker for each permissions class and permission
+    """
+    _breakers = {}
+    _lock = threading.Lock()
+
+    def get(self, permissions_class, perm):
+        name = '{module}.{name}:{perm}'.format(
+            module=permissions_class.__module__,
+            name=permissions_class.__name__,
+            perm=perm,
+        )
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                timeout_settings = perm_settings['timeouts']
+                breaker = CircuitBreaker(name, timeout_settings['threshold'], timeout_settings['cooldown'])
+                self._breakers[name] = breaker
+            return breaker
+
+    def get_states(self):
+        """
+        Return a dict with the state of every breaker, keyed by name
+        """
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return dict((breaker.name, breaker.get_state()) for breaker in breakers)
+
+    def reset(self):
+        with self._lock:
+            self._breakers.clear()
+
+
+def in_atomic_block():
+    """
+    Return True if this thread is in a transaction, whose writes a pool thread cannot see
+    """
+    return any(connections[alias].in_atomic_block for alias in connections)
+
+
+def evaluate_within_budget(permissions, budget):
+    """
+    Evaluate ``permissions._has_perm()`` in a pool thread and wait at most ``budget`` seconds.
+    Raises PermTimeoutExceeded when the budget is exceeded, or PermCircuitOpen when the
+    permission has been too slow too often. Note that the evaluation uses its own database connection.
+    """
+    breaker = circuit_breakers.get(permissions.__class__, permissions.perm)
+    if not breaker.allow():
+        raise PermCircuitOpen(_('Circuit for %(name)s is open.') % {'name': breaker.name})
+    future = _get_executor().submit(call_in_worker, permissions._has_perm)
+    try:
+        result = future.result(timeout=budget)
+    except FuturesTimeoutError:
+        breaker.record_failure()
+        raise PermTimeoutExceeded(_('Permission %(name)s exceeded its budget of %(budget)s seconds.') % {
+            'name': breaker.name,
+            'budget': budget,
+        })
+    except Exception:
+        # An error counts as a failure, otherwise a half open circuit would never close or open again
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return result
+
+
+# Instantiate the singleton
+circuit_breakers = CircuitBreakerRegistry()
+
+
+def get_last_known_expires():
+    """
+    Seconds to keep the last known value for the 'cached' fallback, None (forever) if the cache never expires
+    """
+    expires = perm_settings['cache']['expires']
+    if expires is None:
+        return None
+    return expires * perm_settings['timeouts']['last_known_factor']
+
+
+def get_circuit_breaker_states():
+    """
+    Return the state of all circuit breakers, for monitoring
+    """
+    return circuit_breakers.get_states()
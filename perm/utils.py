@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+from django.db import connections
 from django.utils.six import string_types
 from django.utils.translation import ugettext as _
 
@@ -13,6 +14,65 @@ try:
 except ImportError:
     from django.db.models.loading import get_model
 
+# Get EmptyResultSet across Django versions
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:
+    from django.db.models.sql.datastructures import EmptyResultSet
+
+# Get prefetch_related_objects across Django versions
+try:
+    from django.db.models import prefetch_related_objects
+except ImportError:
+    from django.db.models.query import prefetch_related_objects as _prefetch_related_objects
+
+    def prefetch_related_objects(model_instances, *related_lookups):
+        _prefetch_related_objects(model_instances, related_lookups)
+
+
+class BoundedCache(object):
+    """
+    Dict based cache that starts over when it holds more than ``maxsize`` entries
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = {}
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def set(self, key, value):
+        if len(self._data) >= self.maxsize:
+            self._data = {}
+        self._data[key] = value
+
+    def clear(self):
+        self._data = {}
+
+
+# Parsed 'app.perm' strings and models resolved from 'app.Model' strings
+_perm_cache = BoundedCache(1024)
+_model_cache = BoundedCache(1024)
+_missing = object()
+
+
+def parse_perm(perm):
+    """
+    Split ``perm`` into a tuple (app_label, perm), app_label is None if ``perm`` is not in dot notation
+    """
+    result = _perm_cache.get(perm)
+    if result is None:
+        perm_parts = perm.split('.')
+        if len(perm_parts) > 1:
+            # Raises ValueError for more than one dot, as it always has
+            perm_app, perm_name = perm_parts
+            result = (perm_app, perm_name)
+        else:
+            result = (None, perm)
+        _perm_cache.set(perm, result)
+    return result
+
 
 def get_model_for_perm(model, raise_exception=False):
     """
@@ -22,15 +82,18 @@ def get_model_for_perm(model, raise_exception=False):
     """
     if isinstance(model, string_types):
         # If model is a string, find the appropriate model class
-        try:
-            app_name, model_name = model.split('.')
-        except ValueError:
-            model_class = None
-        else:
+        model_class = _model_cache.get(model, _missing)
+        if model_class is _missing:
             try:
-                model_class = get_model(app_name, model_name)
-            except LookupError:
+                app_name, model_name = model.split('.')
+            except ValueError:
                 model_class = None
+            else:
+                try:
+                    model_class = get_model(app_name, model_name)
+                except LookupError:
+                    model_class = None
+            _model_cache.set(model, model_class)
     else:
         # Assume we have been given a model class or instance
         model_class = model
@@ -45,3 +108,38 @@ def get_model_for_perm(model, raise_exception=False):
 
     # Return the result
     return model_class
+
+
+def get_model_label(model):
+    """
+    Return 'app_label.ModelName' for a model class
+    """
+    return '{app_label}.{model_name}'.format(app_label=model._meta.app_label, model_name=model._meta.object_name)
+
+
+def iter_chunks_by_pk(queryset, chunk_size, get_pk=None):
+    """
+    Iterate over ``queryset`` in lists of at most ``chunk_size`` rows, using keyset pagination on the primary key.
+    ``get_pk`` returns the primary key of a row, by default its ``pk`` attribute.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_queryset[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = get_pk(chunk[-1]) if get_pk else chunk[-1].pk
+
+
+def call_in_worker(func, *args, **kwargs):
+    """
+    Call ``func`` in a pool thread, and close the database connections it opened there afterwards:
+    every pool thread gets its own connections, they must not be left open
+    """
+    try:
+        return func(*args, **kwargs)
+    finally:
+        connections.close_all()
@@ -1,8 +1,12 @@
 from __future__ import unicode_literals
 
 from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
 from django.views.generic import DetailView, UpdateView, CreateView, ListView, DeleteView
 
+from .conf import perm_settings
+from .pagination import CachedCountPaginator, HasNextPaginator
+from .permissions import permissions_manager
 from .shortcuts import get_perm_queryset
 
 
@@ -57,7 +61,11 @@ class PermSingleObjectMixin(PermMixin):
 class PermMultipleObjectMixin(PermMixin):
     """
     Implement the PermMixin ``has_perm`` interface for Class Based Views with a get_queryset function.
+    Set ``prefetch_perms`` to the permissions that will be checked for each object, e.g. in the template.
+    Set ``paginate_without_count`` to paginate without counting the objects, pages only know if there is a next page.
     """
+    prefetch_perms = ()
+    paginate_without_count = False
 
     def get_queryset(self, *args, **kwargs):
         """
@@ -74,9 +82,25 @@ class PermMultipleObjectMixin(PermMixin):
             # Not found? Use the permission queryset
             qs = perm_qs
         else:
-            # Found? Filter it through permission queryset
-            qs = super_qs.filter(pk__in=perm_qs)
-        return qs
+            # Found? Filter it through permission queryset, which becomes a subquery on the same database
+            qs = super_qs.filter(pk__in=perm_qs.using(super_qs.db))
+
+        # Load the related objects that the permission checks need
+        return permissions_manager.prepare_queryset(qs, self.perm, *self.prefetch_perms)
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        """
+        Avoid or cache the count of the permission filtered queryset. Counts are cached if
+        PERM_SETTINGS['counts']['expires'] is set and ``paginator_class`` is not customized.
+        """
+        if self.paginate_without_count:
+            return HasNextPaginator(queryset, per_page, orphans=orphans, allow_empty_first_page=allow_empty_first_page)
+        if perm_settings['counts']['expires'] is None or self.paginator_class is not Paginator:
+            return super(PermMultipleObjectMixin, self).get_paginator(
+                queryset, per_page, orphans=orphans, allow_empty_first_page=allow_empty_first_page, **kwargs)
+        count_key = {'user': self.request.user, 'perm': self.perm}
+        return CachedCountPaginator(queryset, per_page, orphans=orphans,
+                                    allow_empty_first_page=allow_empty_first_page, count_key=count_key)
 
 
 class PermDetailView(PermSingleObjectMixin, DetailView):
@@ -15,7 +15,9 @@ url = 'https://github.com/dyve/django-perm'
 author = 'Dylan Verheul'
 author_email = 'dylan@dyve.net'
 license = 'Apache License 2.0'
-install_requires = []
+install_requires = [
+    'futures; python_version < "3"',
+]
 classifiers = [
     "Development Status :: 4 - Beta",
     "Intended Audience :: Developers",
@@ -5,6 +5,14 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': ':memory:',
     },
+    # Read replica for permission queries, the test database mirrors default
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
 SECRET_KEY = 'ishalltellyouonlyonce'
@@ -54,3 +62,10 @@ TEMPLATES = [
         },
     },
 ]
+
+PERM_SETTINGS = {
+    # Cache the counts of permission lists, this also tests their invalidation
+    'counts': {
+        'expires': 60,
+    },
+}